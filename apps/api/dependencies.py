@@ -1,8 +1,10 @@
 """Dependencies for FastAPI application."""
 
+import orjson
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.engine import make_url
 
 import sys
 sys.path.append('/packages')
@@ -12,13 +14,24 @@ from common.database import Base
 
 settings = get_settings()
 
-# Database setup
+
+def _json_serializer(obj) -> str:
+    """Serialize JSON columns with orjson (SQLAlchemy expects str)."""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+# Database setup (asyncpg driver; keep more prepared statements per connection
+# than the dialect's default of 100 so hot queries skip re-preparing)
 engine = create_async_engine(
-    settings.database.url,
+    make_url(settings.database.url).update_query_dict(
+        {"prepared_statement_cache_size": "512"}
+    ),
     echo=settings.monitoring.debug,
     pool_pre_ping=True,
     pool_size=10,
-    max_overflow=20
+    max_overflow=20,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads
 )
 
 AsyncSessionLocal = sessionmaker(
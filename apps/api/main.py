@@ -173,6 +173,13 @@ async def lifespan(app: FastAPI):
     if redis_client:
         await redis_client.close()
     
+    from services.nowpayments_service import close_client as close_nowpayments_client
+    await close_nowpayments_client()
+    from routers.new_subscriptions import binance_pay_service
+    await binance_pay_service.close()
+    from services.telegram_group_manager import telegram_group_manager
+    await telegram_group_manager.close()
+    
     await engine.dispose()
     logger.info("Winu Bot Signal API shutdown complete")
 
@@ -8,7 +8,7 @@ from typing import Dict, List, Optional
 import json
 
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from common.database import User, SubscriptionEvent
@@ -22,7 +22,12 @@ from services.crypto_payments import (
     activate_subscription_after_payment,
     SUBSCRIPTION_PLANS
 )
-from services.nowpayments_service import NOWPaymentsService, POPULAR_CRYPTOCURRENCIES
+from services.nowpayments_service import (
+    NOWPaymentsService,
+    POPULAR_CRYPTOCURRENCIES,
+    POPULAR_CRYPTOCURRENCIES_JSON,
+    POPULAR_SYMBOLS,
+)
 from common.logging import get_logger
 
 logger = get_logger(__name__)
@@ -46,7 +51,7 @@ async def get_subscription_plans():
                 "id": "nowpayments",
                 "name": "NOWPayments",
                 "description": "Pay with 300+ cryptocurrencies",
-                "supported_currencies": [currency["symbol"].upper() for currency in POPULAR_CRYPTOCURRENCIES],
+                "supported_currencies": [symbol.upper() for symbol in POPULAR_SYMBOLS],
                 "instant_confirmation": True,
                 "popular_currencies": POPULAR_CRYPTOCURRENCIES[:10]  # Top 10 for UI
             },
@@ -445,6 +450,12 @@ async def get_nowpayments_currencies():
         raise HTTPException(status_code=500, detail="Failed to get currencies")
 
 
+@router.get("/nowpayments/currencies/popular")
+async def get_nowpayments_popular_currencies():
+    """Get the curated list of popular NOWPayments cryptocurrencies."""
+    return Response(content=POPULAR_CRYPTOCURRENCIES_JSON, media_type="application/json")
+
+
 @router.get("/nowpayments/estimate")
 async def get_nowpayments_estimate(
     amount: float,
@@ -464,6 +475,26 @@ async def get_nowpayments_estimate(
         raise HTTPException(status_code=500, detail="Failed to get estimate")
 
 
+@router.get("/nowpayments/estimates")
+async def get_nowpayments_estimates(
+    amount: float,
+    currencies: str = "btc,eth,usdt",
+    currency_from: str = "usd"
+):
+    """Get estimated prices from NOWPayments for a comma-separated list of currencies."""
+    try:
+        service = NOWPaymentsService()
+        currency_list = [c.strip().lower() for c in currencies.split(",") if c.strip()]
+        estimates = await service.get_estimates_multi(amount, currency_list, currency_from)
+        return {
+            "status": "success",
+            "estimates": estimates
+        }
+    except Exception as e:
+        logger.error(f"Failed to get NOWPayments estimates: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get estimates")
+
+
 @router.get("/nowpayments/payment/{payment_id}")
 async def get_nowpayments_payment_status(
     payment_id: str,
@@ -556,12 +587,15 @@ async def nowpayments_webhook(
         if not signature_valid:
             logger.warning("Invalid NOWPayments webhook signature")
             await update_webhook_status(db, webhook_log_id, "failed", "Invalid signature")
+            await db.commit()
             raise HTTPException(status_code=400, detail="Invalid signature")
         
         logger.info(f"NOWPayments webhook received: {webhook_data}")
         
-        # Update webhook status to processing
+        # Update webhook status to processing; commit so the log survives a
+        # rollback during activation
         await update_webhook_status(db, webhook_log_id, "processing")
+        await db.commit()
         
         # Invoice is paid when status is "finished", "paid", or "confirmed"
         if payment_status in ["finished", "paid", "confirmed"] and order_id:
@@ -609,13 +643,16 @@ async def nowpayments_webhook(
             logger.info(f"⏳ Payment in progress - Status: {payment_status}, Order: {order_id}")
             await update_webhook_status(db, webhook_log_id, "completed")
         
+        await db.commit()
         return {"status": "success"}
         
     except Exception as e:
         logger.error(f"NOWPayments webhook processing failed: {e}")
         if webhook_log_id:
             try:
+                await db.rollback()
                 await update_webhook_status(db, webhook_log_id, "failed", str(e))
+                await db.commit()
             except:
                 pass
         
@@ -6,7 +6,7 @@ Handles Free Trial, Professional ($14.99), and VIP Elite ($29.99) subscriptions
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -32,11 +32,22 @@ binance_pay_service = SubscriptionBinancePayService()
 
 
 @router.get("/plans", response_model=List[SubscriptionPlanSchema], tags=["Subscriptions"])
-async def get_subscription_plans(db: AsyncSession = Depends(get_db)):
+async def get_subscription_plans(request: Request, db: AsyncSession = Depends(get_db)):
     """Get available subscription plans (public endpoint)."""
     try:
         plans = await binance_pay_service.get_subscription_plans(db)
-        return plans
+        if plans:
+            return plans
+        
+        # Database unavailable or empty: serve the built-in catalogue
+        etag = binance_pay_service.static_plans_etag
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(
+            content=binance_pay_service.static_plans_json,
+            media_type="application/json",
+            headers={"ETag": etag}
+        )
     except Exception as e:
         logger.error(f"Error getting subscription plans: {e}")
         raise HTTPException(status_code=500, detail="Failed to get subscription plans")
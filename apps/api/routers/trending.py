@@ -2,7 +2,7 @@
 
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc, and_
+from sqlalchemy import select, desc, and_, func
 from datetime import datetime, timedelta
 from typing import List, Optional
 from loguru import logger
@@ -83,28 +83,21 @@ async def get_trending_stats(db: AsyncSession = Depends(get_db)):
     """Get trending coins statistics."""
     try:
         # Count active trending assets
-        assets_result = await db.execute(
-            select(Asset).where(Asset.active == True)
+        total_assets = await db.scalar(
+            select(func.count()).select_from(Asset).where(Asset.active == True)
         )
-        total_assets = len(assets_result.scalars().all())
         
-        # Count recent trending signals
+        # Count total and trending signals in last 24h in one pass
         cutoff_time = datetime.utcnow() - timedelta(hours=24)
         signals_result = await db.execute(
-            select(Signal).where(
-                and_(
-                    Signal.created_at > cutoff_time,
+            select(
+                func.count(),
+                func.count().filter(
                     Signal.context.op('->>')('trending_analysis') == 'true'
                 )
-            )
-        )
-        trending_signals = len(signals_result.scalars().all())
-        
-        # Count total signals in last 24h
-        total_signals_result = await db.execute(
-            select(Signal).where(Signal.created_at > cutoff_time)
+            ).select_from(Signal).where(Signal.created_at > cutoff_time)
         )
-        total_signals = len(total_signals_result.scalars().all())
+        total_signals, trending_signals = signals_result.one()
         
         return {
             "total_assets": total_assets,
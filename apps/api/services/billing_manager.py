@@ -7,7 +7,7 @@ import asyncio
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, insert, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import sys
@@ -18,6 +18,9 @@ from common.logging import get_logger
 
 logger = get_logger(__name__)
 
+# Length of the free trial (see SubscriptionBinancePayService.start_free_trial)
+TRIAL_DURATION_DAYS = 7
+
 
 class BillingManager:
     """Manages automated billing and payment processing."""
@@ -122,6 +125,65 @@ class BillingManager:
             await db.rollback()
             raise
     
+    async def cleanup_expired_trials(self, db: AsyncSession, batch_size: int = 500) -> Dict[str, Any]:
+        """Mark expired free trials inactive.
+        
+        Moves users from 'trial' to 'inactive' once the trial period has passed,
+        the same transition the subscription middleware applies to lapsed paid
+        subscriptions, and records a trial_expired event for each of them.
+        
+        Claims up to `batch_size` expired trials with FOR UPDATE SKIP LOCKED so
+        concurrent workers never process the same users, and returns without
+        writing anything when no trial has expired.
+        """
+        try:
+            now = datetime.utcnow()
+            
+            result = await db.execute(
+                select(User.id)
+                .where(
+                    and_(
+                        User.subscription_status == "trial",
+                        User.trial_start_date < now - timedelta(days=TRIAL_DURATION_DAYS)
+                    )
+                )
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            user_ids = result.scalars().all()
+            
+            if not user_ids:
+                await db.rollback()
+                return {"success": True, "trials_cleaned": 0}
+            
+            await db.execute(
+                update(User)
+                .where(User.id.in_(user_ids))
+                .values(subscription_status="inactive", subscription_updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            await db.execute(
+                insert(SubscriptionEvent),
+                [
+                    {
+                        "user_id": user_id,
+                        "event_type": "trial_expired",
+                        "event_data": {"expired_at": now.isoformat()},
+                        "processed": True
+                    }
+                    for user_id in user_ids
+                ]
+            )
+            await db.commit()
+            
+            logger.info(f"Expired trials cleaned up for {len(user_ids)} users")
+            return {"success": True, "trials_cleaned": len(user_ids)}
+            
+        except Exception as e:
+            logger.error(f"Error cleaning up expired trials: {e}")
+            await db.rollback()
+            return {"error": str(e)}
+    
     async def _check_overdue_payments(self, db: AsyncSession) -> Dict[str, Any]:
         """Check for overdue payments and handle them."""
         try:
@@ -6,22 +6,56 @@ Supports 300+ cryptocurrencies with non-custodial payments
 import asyncio
 import hashlib
 import hmac
-import json
 import os
+import secrets
 import time
-import uuid
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 
 import httpx
+import orjson
 from fastapi import HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from common.database import User, PaymentTransaction, SubscriptionEvent
 from common.logging import get_logger
 
 logger = get_logger(__name__)
 
+# Retry policy for transient NOWPayments failures
+_MAX_ATTEMPTS = 3
+_RETRY_BACKOFF = 0.1
+_RETRY_STATUSES = frozenset({502, 503, 504})
+
+# Display names for known plan IDs, same output as plan_id.replace('_', ' ').title()
+_PLAN_DESCRIPTIONS = {
+    "professional": "Professional",
+    "vip_elite": "Vip Elite",
+}
+
+# Shared HTTP/2 client so requests reuse one pooled TLS connection
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Get the process-wide NOWPayments HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=2,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=50)
+            ),
+            timeout=30.0
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared NOWPayments HTTP client."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
 
 class NOWPaymentsService:
     """NOWPayments service for cryptocurrency payments."""
@@ -44,17 +78,16 @@ class NOWPaymentsService:
             self.base_url = "https://api.nowpayments.io/v1"
             logger.info("💰 NOWPayments initialized in PRODUCTION mode")
         
-        if not self.api_key:
-            logger.warning("⚠️  NOWPayments API key not configured")
-        else:
-            logger.info(f"✅ NOWPayments API key configured: {self.api_key[:10]}...")
-    
-    def _get_headers(self) -> Dict[str, str]:
-        """Get headers for API requests."""
-        return {
+        # Headers are constant per instance, build them once
+        self._headers = {
             "x-api-key": self.api_key,
             "Content-Type": "application/json"
         }
+        
+        if not self.api_key:
+            logger.warning("⚠️  NOWPayments API key not configured")
+        else:
+            logger.info("✅ NOWPayments API key configured: {}...", self.api_key[:10])
     
     def _generate_ipn_signature(self, payload: str) -> str:
         """Generate IPN signature for webhook verification."""
@@ -64,24 +97,62 @@ class NOWPaymentsService:
             hashlib.sha512
         ).hexdigest()
     
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        expect: Tuple[int, ...] = (200,),
+        error_detail: str = "NOWPayments request failed"
+    ) -> Any:
+        """Send a request to the NOWPayments API and decode the JSON body.
+        
+        GETs are retried with backoff on network errors and 502/503/504;
+        POSTs only get connect-level retries so payments are never duplicated.
+        """
+        retryable = method == "GET"
+        content = orjson.dumps(json) if json is not None else None
+        client = _get_client()
+        for attempt in range(_MAX_ATTEMPTS):
+            last_attempt = not retryable or attempt == _MAX_ATTEMPTS - 1
+            try:
+                response = await client.request(
+                    method,
+                    f"{self.base_url}{path}",
+                    params=params,
+                    content=content,
+                    headers=self._headers
+                )
+            except httpx.TransportError as e:
+                if last_attempt:
+                    raise
+                logger.warning(f"NOWPayments {method} {path} failed ({e!r}), retrying")
+            else:
+                if response.status_code not in _RETRY_STATUSES or last_attempt:
+                    break
+                logger.warning(f"NOWPayments {method} {path} returned {response.status_code}, retrying")
+            await asyncio.sleep(_RETRY_BACKOFF * 2 ** attempt)
+        
+        if response.status_code not in expect:
+            body = response.text
+            logger.error(f"NOWPayments API error - {method} {path} - Status: {response.status_code}, Response: {body}")
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"{error_detail}: {body}"
+            )
+        
+        return orjson.loads(response.content)
+    
     async def get_available_currencies(self) -> Dict[str, Any]:
         """Get list of available cryptocurrencies."""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/currencies",
-                    headers=self._get_headers(),
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Failed to get currencies: {response.text}"
-                    )
-        except Exception as e:
+            return await self._request(
+                "GET", "/currencies",
+                error_detail="Failed to get currencies"
+            )
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
             logger.error(f"Error getting currencies: {e}")
             raise HTTPException(status_code=500, detail="Failed to get available currencies")
     
@@ -97,22 +168,12 @@ class NOWPaymentsService:
                 "currency_to": currency_to
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/min-amount",
-                    params=params,
-                    headers=self._get_headers(),
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Failed to get minimum amount: {response.text}"
-                    )
-        except Exception as e:
+            return await self._request(
+                "GET", "/min-amount",
+                params=params,
+                error_detail="Failed to get minimum amount"
+            )
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
             logger.error(f"Error getting minimum amount: {e}")
             raise HTTPException(status_code=500, detail="Failed to get minimum amount")
     
@@ -130,25 +191,35 @@ class NOWPaymentsService:
                 "currency_to": currency_to
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/estimate",
-                    params=params,
-                    headers=self._get_headers(),
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Failed to get estimated price: {response.text}"
-                    )
-        except Exception as e:
+            return await self._request(
+                "GET", "/estimate",
+                params=params,
+                error_detail="Failed to get estimated price"
+            )
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
             logger.error(f"Error getting estimated price: {e}")
             raise HTTPException(status_code=500, detail="Failed to get estimated price")
     
+    async def get_estimates_multi(
+        self,
+        amount: float,
+        currencies: List[str],
+        currency_from: str = "usd"
+    ) -> Dict[str, Any]:
+        """Get estimated prices for several pay currencies concurrently."""
+        results = await asyncio.gather(
+            *(self.get_estimated_price(amount, currency_from, c) for c in currencies),
+            return_exceptions=True
+        )
+        
+        estimates = {}
+        for currency, result in zip(currencies, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Estimate for {currency} failed: {result}")
+                continue
+            estimates[currency] = result
+        return estimates
+    
     async def create_payment(
         self,
         price_amount: float,
@@ -166,64 +237,49 @@ class NOWPaymentsService:
         """Create a new payment."""
         
         if not order_id:
-            order_id = f"WINU_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+            order_id = f"WINU_{time.time_ns() // 1_000_000_000}_{secrets.token_hex(4)}"
         
         # Default IPN callback URL
         if not ipn_callback_url:
             ipn_callback_url = f"{os.getenv('API_BASE_URL', 'https://api.winu.app')}/api/crypto-subscriptions/webhooks/nowpayments"
         
-        payment_data = {
+        # Optional fields are only sent when provided
+        payment_data = {k: v for k, v in {
             "price_amount": price_amount,
             "price_currency": price_currency,
             "pay_currency": pay_currency,
             "order_id": order_id,
             "order_description": order_description,
             "ipn_callback_url": ipn_callback_url,
-            "case": case or "success"
-        }
-        
-        # Only add optional fields if they are provided
-        if customer_email:
-            payment_data["customer_email"] = customer_email
-        if payout_address:
-            payment_data["payout_address"] = payout_address
-        if payout_currency:
-            payment_data["payout_currency"] = payout_currency
-        if payout_extra_id:
-            payment_data["payout_extra_id"] = payout_extra_id
+            "case": case or "success",
+            "customer_email": customer_email or None,
+            "payout_address": payout_address or None,
+            "payout_currency": payout_currency or None,
+            "payout_extra_id": payout_extra_id or None
+        }.items() if v is not None}
         
         try:
-            logger.info(f"Creating NOWPayments payment with data: {payment_data}")
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/payment",
-                    json=payment_data,
-                    headers=self._get_headers(),
-                    timeout=30.0
-                )
-                
-                if response.status_code == 201:
-                    data = response.json()
-                    return {
-                        "payment_id": data.get("payment_id"),
-                        "payment_status": data.get("payment_status"),
-                        "pay_address": data.get("pay_address"),
-                        "price_amount": data.get("price_amount"),
-                        "price_currency": data.get("price_currency"),
-                        "pay_currency": data.get("pay_currency"),
-                        "order_id": data.get("order_id"),
-                        "order_description": data.get("order_description"),
-                        "payment_url": data.get("payment_url"),
-                        "created_at": data.get("created_at"),
-                        "updated_at": data.get("updated_at")
-                    }
-                else:
-                    logger.error(f"NOWPayments API error - Status: {response.status_code}, Response: {response.text}")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Failed to create payment: {response.text}"
-                    )
-        except Exception as e:
+            logger.info("Creating NOWPayments payment with data: {}", payment_data)
+            data = await self._request(
+                "POST", "/payment",
+                json=payment_data,
+                expect=(201,),
+                error_detail="Failed to create payment"
+            )
+            return {
+                "payment_id": data.get("payment_id"),
+                "payment_status": data.get("payment_status"),
+                "pay_address": data.get("pay_address"),
+                "price_amount": data.get("price_amount"),
+                "price_currency": data.get("price_currency"),
+                "pay_currency": data.get("pay_currency"),
+                "order_id": data.get("order_id"),
+                "order_description": data.get("order_description"),
+                "payment_url": data.get("payment_url"),
+                "created_at": data.get("created_at"),
+                "updated_at": data.get("updated_at")
+            }
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
             logger.error(f"Error creating payment: {e}")
             raise HTTPException(status_code=500, detail="Failed to create payment")
     
@@ -241,7 +297,7 @@ class NOWPaymentsService:
         """Create an invoice for hosted payment page."""
         
         if not order_id:
-            order_id = f"WINU_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+            order_id = f"WINU_{time.time_ns() // 1_000_000_000}_{secrets.token_hex(4)}"
         
         # Default IPN callback URL
         if not ipn_callback_url:
@@ -267,77 +323,46 @@ class NOWPaymentsService:
             invoice_data["customer_email"] = customer_email
         
         try:
-            logger.info(f"Creating NOWPayments invoice with data: {invoice_data}")
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/invoice",
-                    json=invoice_data,
-                    headers=self._get_headers(),
-                    timeout=30.0
-                )
-                
-                if response.status_code == 201 or response.status_code == 200:
-                    data = response.json()
-                    invoice_id = data.get("id")
-                    return {
-                        "invoice_id": invoice_id,
-                        "invoice_url": data.get("invoice_url") or f"https://nowpayments.io/payment/?iid={invoice_id}",
-                        "order_id": data.get("order_id"),
-                        "price_amount": data.get("price_amount"),
-                        "price_currency": data.get("price_currency"),
-                        "order_description": data.get("order_description"),
-                        "created_at": data.get("created_at")
-                    }
-                else:
-                    logger.error(f"NOWPayments invoice API error - Status: {response.status_code}, Response: {response.text}")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Failed to create invoice: {response.text}"
-                    )
-        except Exception as e:
+            logger.info("Creating NOWPayments invoice with data: {}", invoice_data)
+            data = await self._request(
+                "POST", "/invoice",
+                json=invoice_data,
+                expect=(200, 201),
+                error_detail="Failed to create invoice"
+            )
+            invoice_id = data.get("id")
+            return {
+                "invoice_id": invoice_id,
+                "invoice_url": data.get("invoice_url") or f"https://nowpayments.io/payment/?iid={invoice_id}",
+                "order_id": data.get("order_id"),
+                "price_amount": data.get("price_amount"),
+                "price_currency": data.get("price_currency"),
+                "order_description": data.get("order_description"),
+                "created_at": data.get("created_at")
+            }
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
             logger.error(f"Error creating invoice: {e}")
             raise HTTPException(status_code=500, detail="Failed to create invoice")
     
     async def get_invoice_status(self, invoice_id: str) -> Dict[str, Any]:
         """Get invoice status by invoice ID."""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/invoice/{invoice_id}",
-                    headers=self._get_headers(),
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.error(f"Failed to get invoice status: {response.text}")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail="Failed to get invoice status"
-                    )
-        except Exception as e:
+            return await self._request(
+                "GET", f"/invoice/{invoice_id}",
+                error_detail="Failed to get invoice status"
+            )
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
             logger.error(f"Error getting invoice status: {e}")
             raise HTTPException(status_code=500, detail="Failed to get invoice status")
     
     async def get_payment_status(self, payment_id: str) -> Dict[str, Any]:
         """Get payment status by payment ID."""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/payment/{payment_id}",
-                    headers=self._get_headers(),
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Failed to get payment status: {response.text}"
-                    )
-        except Exception as e:
+            return await self._request(
+                "GET", f"/payment/{payment_id}",
+                error_detail="Failed to get payment status"
+            )
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
             logger.error(f"Error getting payment status: {e}")
             raise HTTPException(status_code=500, detail="Failed to get payment status")
     
@@ -346,22 +371,12 @@ class NOWPaymentsService:
         try:
             params = {"order_id": order_id}
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/payment",
-                    params=params,
-                    headers=self._get_headers(),
-                    timeout=30.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Failed to get payment by order ID: {response.text}"
-                    )
-        except Exception as e:
+            return await self._request(
+                "GET", "/payment",
+                params=params,
+                error_detail="Failed to get payment by order ID"
+            )
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
             logger.error(f"Error getting payment by order ID: {e}")
             raise HTTPException(status_code=500, detail="Failed to get payment by order ID")
     
@@ -377,15 +392,16 @@ class NOWPaymentsService:
         """Create a subscription payment using NOWPayments."""
         
         # Generate unique order ID
-        order_id = f"WINU_SUB_{user_id}_{plan_id}_{int(time.time())}"
+        order_id = f"WINU_SUB_{user_id}_{plan_id}_{time.time_ns() // 1_000_000_000}"
         
         # Use invoice for better UX (hosted payment page)
         if use_invoice:
+            plan_name = _PLAN_DESCRIPTIONS.get(plan_id) or plan_id.replace('_', ' ').title()
             invoice_result = await self.create_invoice(
                 price_amount=amount_usd,
                 price_currency="usd",
                 order_id=order_id,
-                order_description=f"Winu Trading Bot - {plan_id.replace('_', ' ').title()} Subscription",
+                order_description=f"Winu Trading Bot - {plan_name} Subscription",
                 customer_email=customer_email
             )
             
@@ -451,4 +467,11 @@ POPULAR_CRYPTOCURRENCIES = [
     {"symbol": "doge", "name": "Dogecoin", "network": "doge"},
     {"symbol": "shib", "name": "Shiba Inu", "network": "eth"},
     {"symbol": "avax", "name": "Avalanche", "network": "avax"}
-]
\ No newline at end of file
+]
+
+# Read-only views of the table above, built once at import time
+POPULAR_SYMBOLS: Tuple[str, ...] = tuple(c["symbol"] for c in POPULAR_CRYPTOCURRENCIES)
+POPULAR_BY_SYMBOL: Dict[str, Tuple[str, str]] = {
+    c["symbol"]: (c["name"], c["network"]) for c in POPULAR_CRYPTOCURRENCIES
+}
+POPULAR_CRYPTOCURRENCIES_JSON: bytes = orjson.dumps(POPULAR_CRYPTOCURRENCIES)
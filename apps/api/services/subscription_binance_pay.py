@@ -6,18 +6,19 @@ Supports Free Trial, Professional ($14.99), and VIP Elite ($29.99) tiers
 import asyncio
 import hashlib
 import hmac
-import json
 import os
 import time
-import uuid
+from collections import deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
-from urllib.parse import urlencode
+from typing import Dict, List, Optional, Any, Tuple
+from urllib.parse import quote_plus
 
 import httpx
+import orjson
 from fastapi import HTTPException
-from sqlalchemy import select
+from sqlalchemy import bindparam, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
 from common.database import User, SubscriptionPlan, PaymentTransaction, SubscriptionEvent, TelegramGroupAccess
 from common.logging import get_logger
@@ -25,6 +26,25 @@ from common.schemas import BinancePaySubscriptionRequest
 
 logger = get_logger(__name__)
 
+# Statements built once at import; values are bound per execution
+_SELECT_TRANSACTION = select(PaymentTransaction).where(
+    PaymentTransaction.transaction_id == bindparam("transaction_id")
+)
+_SELECT_TRANSACTION_WITH_USER = _SELECT_TRANSACTION.options(joinedload(PaymentTransaction.user))
+_SELECT_ACTIVE_PLANS = select(SubscriptionPlan).where(SubscriptionPlan.is_active == True)
+
+# Nonces generated per os.urandom call
+_NONCE_POOL_SIZE = 256
+
+# How long get_subscription_plans serves the cached plan list, in seconds
+_PLANS_CACHE_TTL = 300
+
+# Fields of the order payload, in the sorted order they are signed in
+_ORDER_SIGNATURE_KEYS = tuple(sorted((
+    "merchantId", "prepayId", "totalFee", "productType", "productName",
+    "productDetail", "returnUrl", "cancelUrl", "notifyUrl"
+)))
+
 
 class SubscriptionBinancePayService:
     """Enhanced Binance Pay service for subscription payments."""
@@ -35,7 +55,15 @@ class SubscriptionBinancePayService:
         self.api_base = "https://bpay.binanceapi.com"
         self.api_key = os.getenv("BINANCE_PAY_API_KEY", "")
         self.secret_key = os.getenv("BINANCE_PAY_SECRET_KEY", "")
-        self.webhook_secret = os.getenv("BINANCE_PAY_WEBHOOK_SECRET", "")
+        
+        # Keyed HMAC state, copied per signature instead of re-deriving the key pads.
+        # Naming the digest makes hmac use OpenSSL's HMAC, which picks SHA-NI/AVX2 at runtime.
+        self._secret_bytes = self.secret_key.encode('utf-8')
+        self._hmac_template = hmac.new(self._secret_bytes, b'', 'sha256')
+        self._sig_keys = frozenset(_ORDER_SIGNATURE_KEYS)
+        self._sig_key_prefixes = tuple(
+            (key, quote_plus(key).encode() + b'=') for key in _ORDER_SIGNATURE_KEYS
+        )
         
         # Subscription plans configuration
         self.subscription_plans = {
@@ -89,25 +117,110 @@ class SubscriptionBinancePayService:
             }
         }
         
+        self._plan_ids = frozenset(self.subscription_plans)
+        
+        # Built-in plan catalogue in the /plans response shape, served when the DB has none
+        self.static_plans_json = orjson.dumps([
+            {
+                "id": plan_id,
+                "name": plan["name"],
+                "price_usd": plan["price_usd"],
+                "price_usdt": plan["price_usdt"],
+                "interval": plan.get("interval", "trial"),
+                "duration_days": plan.get("duration_days", 30),
+                "dashboard_access_limit": plan.get("dashboard_access_limit", -1),
+                "features": plan["features"],
+                "telegram_access": plan["telegram_access"],
+                "support_level": plan["support_level"],
+                "binance_pay_id": plan.get("binance_pay_id"),
+                "is_active": True
+            }
+            for plan_id, plan in self.subscription_plans.items()
+        ])
+        self.static_plans_etag = f'W/"{hashlib.sha256(self.static_plans_json).hexdigest()[:16]}"'
+        
+        # Static part of each plan's order payload
+        self._payload_templates = {
+            plan_id: {
+                "merchantId": self.merchant_id,
+                "totalFee": {
+                    "currency": "USDT",
+                    "amount": str(plan["price_usdt"])
+                },
+                "productType": "Subscription",
+                "productName": f"Winu {plan['name']} - Monthly Subscription",
+                "productDetail": f"Monthly subscription for {plan['name']} plan",
+                "notifyUrl": "https://api.winu.app/api/subscriptions/binance-pay/webhook"
+            }
+            for plan_id, plan in self.subscription_plans.items()
+        }
+        
+        # (fetched_at, plans) from the last successful get_subscription_plans query
+        self._plans_cache: Optional[Tuple[float, List[Dict[str, Any]]]] = None
+        self._plans_lock = asyncio.Lock()
+        
+        # Pre-generated request nonces (only touched from sync code, so no lock needed)
+        self._nonce_pool: deque = deque()
+        
+        # Strong references to in-flight post-webhook tasks
+        self._background_tasks: set = set()
+        
+        # Pooled HTTP/2 client, created on first use
+        self._client: Optional[httpx.AsyncClient] = None
+        
         if not all([self.api_key, self.secret_key]):
             logger.warning("Binance Pay credentials not configured - using test mode")
     
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the shared Binance Pay HTTP client."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_base,
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+                timeout=30.0
+            )
+        return self._client
+    
+    async def close(self):
+        """Close the shared HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
     def _generate_signature(self, params: Dict[str, Any]) -> str:
         """Generate HMAC signature for Binance Pay API."""
-        query_string = urlencode(sorted(params.items()))
-        return hmac.new(
-            self.secret_key.encode('utf-8'),
-            query_string.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
+        # Same bytes as urlencode(sorted(params.items())), without re-sorting known payloads
+        if params.keys() == self._sig_keys:
+            key_prefixes = self._sig_key_prefixes
+        else:
+            key_prefixes = [(key, quote_plus(str(key)).encode() + b'=') for key in sorted(params)]
+        
+        buf = bytearray()
+        for key, prefix in key_prefixes:
+            if buf:
+                buf += b'&'
+            buf += prefix
+            buf += quote_plus(str(params[key])).encode()
+        
+        mac = self._hmac_template.copy()
+        mac.update(buf)
+        return mac.hexdigest()
+    
+    def _next_nonce(self) -> str:
+        """Get a random 32-char hex nonce, refilling the pool with one urandom read."""
+        if not self._nonce_pool:
+            buf = os.urandom(16 * _NONCE_POOL_SIZE)
+            self._nonce_pool.extend(buf[i:i + 16].hex() for i in range(0, len(buf), 16))
+        return self._nonce_pool.popleft()
     
     def _get_headers(self, params: Dict[str, Any]) -> Dict[str, str]:
         """Get headers with signature for API requests."""
         signature = self._generate_signature(params)
         return {
             "Content-Type": "application/json",
-            "BinancePay-Timestamp": str(int(time.time() * 1000)),
-            "BinancePay-Nonce": str(uuid.uuid4()),
+            "BinancePay-Timestamp": str(time.time_ns() // 1_000_000),
+            "BinancePay-Nonce": self._next_nonce(),
             "BinancePay-Certificate-SN": self.api_key,
             "BinancePay-Signature": signature
         }
@@ -116,8 +229,7 @@ class SubscriptionBinancePayService:
         """Start free trial for a user."""
         try:
             # Get user
-            result = await db.execute(select(User).where(User.id == user_id))
-            user = result.scalar_one_or_none()
+            user = await db.get(User, user_id)
             
             if not user:
                 raise HTTPException(status_code=404, detail="User not found")
@@ -180,14 +292,13 @@ class SubscriptionBinancePayService:
         
         try:
             # Validate plan
-            if plan_id not in self.subscription_plans:
+            if plan_id not in self._plan_ids:
                 raise HTTPException(status_code=400, detail="Invalid subscription plan")
             
             plan = self.subscription_plans[plan_id]
             
             # Get user
-            result = await db.execute(select(User).where(User.id == user_id))
-            user = result.scalar_one_or_none()
+            user = await db.get(User, user_id)
             
             if not user:
                 raise HTTPException(status_code=404, detail="User not found")
@@ -195,6 +306,74 @@ class SubscriptionBinancePayService:
             # Generate unique payment ID
             payment_id = f"winu_sub_{user_id}_{plan_id}_{int(time.time())}"
             
+            payment_data = {
+                "merchant_id": self.merchant_id,
+                "plan_name": plan["name"],
+                "telegram_user_id": request.telegram_user_id,
+                "telegram_username": request.telegram_username
+            }
+            
+            # If no API keys configured, return test mode response
+            if not self.api_key or not self.secret_key:
+                response_data = {
+                    "success": True,
+                    "payment_url": f"https://test.binance.com/en/pay/test-payment?merchantId={self.merchant_id}&amount={plan['price_usdt']}",
+                    "payment_id": payment_id,
+                    "amount_usdt": plan["price_usdt"],
+                    "plan": plan,
+                    "test_mode": True,
+                    "message": "Test mode - payment URL generated"
+                }
+            else:
+                # End the read transaction so no connection is held open during the API call;
+                # the order records are written in one short transaction afterwards
+                await db.commit()
+                
+                # Prepare Binance Pay API payload
+                payload = self._payload_templates[plan_id] | {
+                    "prepayId": payment_id,
+                    "returnUrl": f"https://winu.app/payment/success?payment_id={payment_id}",
+                    "cancelUrl": f"https://winu.app/payment/cancel?payment_id={payment_id}"
+                }
+                
+                # Make API call to Binance Pay
+                headers = self._get_headers(payload)
+                
+                client = self._get_client()
+                response = await client.post(
+                    "/binancepay/openapi/v2/order",
+                    headers=headers,
+                    content=orjson.dumps(payload)
+                )
+                
+                if response.status_code != 200:
+                    raise HTTPException(
+                        status_code=500, 
+                        detail=f"Binance Pay API error: {response.status_code}"
+                    )
+                
+                result = response.json()
+                
+                if result.get("status") != "SUCCESS":
+                    raise HTTPException(
+                        status_code=400, 
+                        detail=f"Binance Pay error: {result.get('message', 'Unknown error')}"
+                    )
+                
+                payment_url = result["data"]["checkoutUrl"]
+                payment_data["binance_pay_response"] = result["data"]
+                payment_data["checkout_url"] = payment_url
+                
+                response_data = {
+                    "success": True,
+                    "payment_url": payment_url,
+                    "payment_id": payment_id,
+                    "amount_usdt": plan["price_usdt"],
+                    "plan": plan,
+                    "qr_code": result["data"].get("qrCodeUrl"),
+                    "message": f"Payment created for {plan['name']}"
+                }
+            
             # Create payment transaction record
             transaction = PaymentTransaction(
                 user_id=user_id,
@@ -204,12 +383,7 @@ class SubscriptionBinancePayService:
                 payment_method="binance_pay",
                 transaction_id=payment_id,
                 status="pending",
-                payment_data={
-                    "merchant_id": self.merchant_id,
-                    "plan_name": plan["name"],
-                    "telegram_user_id": request.telegram_user_id,
-                    "telegram_username": request.telegram_username
-                }
+                payment_data=payment_data
             )
             db.add(transaction)
             
@@ -229,78 +403,8 @@ class SubscriptionBinancePayService:
             
             await db.commit()
             
-            # If no API keys configured, return test mode response
-            if not self.api_key or not self.secret_key:
-                return {
-                    "success": True,
-                    "payment_url": f"https://test.binance.com/en/pay/test-payment?merchantId={self.merchant_id}&amount={plan['price_usdt']}",
-                    "payment_id": payment_id,
-                    "amount_usdt": plan["price_usdt"],
-                    "plan": plan,
-                    "test_mode": True,
-                    "message": "Test mode - payment URL generated"
-                }
-            
-            # Prepare Binance Pay API payload
-            payload = {
-                "merchantId": self.merchant_id,
-                "prepayId": payment_id,
-                "totalFee": {
-                    "currency": "USDT",
-                    "amount": str(plan["price_usdt"])
-                },
-                "productType": "Subscription",
-                "productName": f"Winu {plan['name']} - Monthly Subscription",
-                "productDetail": f"Monthly subscription for {plan['name']} plan",
-                "returnUrl": f"https://winu.app/payment/success?payment_id={payment_id}",
-                "cancelUrl": f"https://winu.app/payment/cancel?payment_id={payment_id}",
-                "notifyUrl": f"https://api.winu.app/api/subscriptions/binance-pay/webhook"
-            }
-            
-            # Make API call to Binance Pay
-            headers = self._get_headers(payload)
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.api_base}/binancepay/openapi/v2/order",
-                    headers=headers,
-                    json=payload,
-                    timeout=30.0
-                )
+            return response_data
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    if result.get("status") == "SUCCESS":
-                        payment_url = result["data"]["checkoutUrl"]
-                        
-                        # Update transaction with Binance Pay response
-                        transaction.payment_data.update({
-                            "binance_pay_response": result["data"],
-                            "checkout_url": payment_url
-                        })
-                        await db.commit()
-                        
-                        return {
-                            "success": True,
-                            "payment_url": payment_url,
-                            "payment_id": payment_id,
-                            "amount_usdt": plan["price_usdt"],
-                            "plan": plan,
-                            "qr_code": result["data"].get("qrCodeUrl"),
-                            "message": f"Payment created for {plan['name']}"
-                        }
-                    else:
-                        raise HTTPException(
-                            status_code=400, 
-                            detail=f"Binance Pay error: {result.get('message', 'Unknown error')}"
-                        )
-                else:
-                    raise HTTPException(
-                        status_code=500, 
-                        detail=f"Binance Pay API error: {response.status_code}"
-                    )
-                    
         except Exception as e:
             logger.error(f"Error creating subscription payment: {e}")
             await db.rollback()
@@ -315,9 +419,9 @@ class SubscriptionBinancePayService:
             if not payment_id:
                 return {"success": False, "error": "Missing payment ID"}
             
-            # Get transaction
+            # Get transaction and its user in one joined query
             result = await db.execute(
-                select(PaymentTransaction).where(PaymentTransaction.transaction_id == payment_id)
+                _SELECT_TRANSACTION_WITH_USER, {"transaction_id": payment_id}
             )
             transaction = result.scalar_one_or_none()
             
@@ -325,9 +429,7 @@ class SubscriptionBinancePayService:
                 logger.error(f"Transaction not found for payment ID: {payment_id}")
                 return {"success": False, "error": "Transaction not found"}
             
-            # Get user
-            result = await db.execute(select(User).where(User.id == transaction.user_id))
-            user = result.scalar_one_or_none()
+            user = transaction.user
             
             if not user:
                 logger.error(f"User not found for transaction: {payment_id}")
@@ -335,42 +437,23 @@ class SubscriptionBinancePayService:
             
             # Update transaction status
             transaction.status = "completed" if status == "SUCCESS" else "failed"
-            transaction.completed_at = datetime.utcnow()
-            transaction.payment_data.update({"webhook_data": webhook_data})
+            now = datetime.utcnow()
+            transaction.completed_at = now
+            transaction.payment_data = {**(transaction.payment_data or {}), "webhook_data": webhook_data}
             
             if status == "SUCCESS":
                 # Activate subscription
-                await self._activate_subscription(user, transaction, db)
-                
-                # Create success event
-                event = SubscriptionEvent(
-                    user_id=user.id,
-                    event_type="payment_completed",
-                    event_data={
-                        "plan_id": transaction.plan_id,
-                        "amount_usdt": float(transaction.amount_usdt),
-                        "payment_id": payment_id,
-                        "transaction_id": transaction.id
-                    },
-                    processed=True
-                )
-                db.add(event)
-            else:
-                # Create failure event
-                event = SubscriptionEvent(
-                    user_id=user.id,
-                    event_type="payment_failed",
-                    event_data={
-                        "plan_id": transaction.plan_id,
-                        "payment_id": payment_id,
-                        "failure_reason": webhook_data.get("message", "Unknown error")
-                    },
-                    processed=True
-                )
-                db.add(event)
+                await self._activate_subscription(user, transaction, db, now=now)
             
             await db.commit()
             
+            # Event logging and Telegram grant don't need to hold up Binance's webhook call
+            task = asyncio.create_task(
+                self._post_webhook_work(transaction.id, status, webhook_data.get("message", "Unknown error"))
+            )
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+            
             logger.info(f"Payment webhook processed: {payment_id} - {status}")
             
             return {
@@ -384,80 +467,145 @@ class SubscriptionBinancePayService:
             await db.rollback()
             return {"success": False, "error": str(e)}
     
-    async def _activate_subscription(self, user: User, transaction: PaymentTransaction, db: AsyncSession):
+    async def _activate_subscription(
+        self,
+        user: User,
+        transaction: PaymentTransaction,
+        db: AsyncSession,
+        now: Optional[datetime] = None
+    ):
         """Activate subscription for user after successful payment."""
         try:
-            plan = self.subscription_plans[transaction.plan_id]
+            if transaction.plan_id not in self._plan_ids:
+                raise ValueError(f"Unknown subscription plan: {transaction.plan_id}")
+            
+            # One timestamp for the whole activation so the dates line up
+            if now is None:
+                now = datetime.utcnow()
+            renewal_date = now + timedelta(days=30)
             
             # Update user subscription
             user.subscription_tier = transaction.plan_id
             user.subscription_status = "active"
-            user.payment_due_date = datetime.utcnow() + timedelta(days=30)  # 30 days from now
-            user.subscription_renewal_date = datetime.utcnow() + timedelta(days=30)
-            user.last_payment_date = datetime.utcnow()
+            user.payment_due_date = renewal_date  # 30 days from now
+            user.subscription_renewal_date = renewal_date
+            user.last_payment_date = now
             user.payment_method = "binance_pay"
             user.access_revoked_at = None  # Clear any previous revocation
             
-            # Grant Telegram access if applicable
-            if plan["telegram_access"] and transaction.payment_data.get("telegram_user_id"):
-                # Import and use Telegram group manager
-                from services.telegram_group_manager import telegram_group_manager
-                
-                telegram_result = await telegram_group_manager.grant_telegram_access(
-                    user=user,
-                    subscription_tier=transaction.plan_id,
-                    telegram_user_id=transaction.payment_data["telegram_user_id"],
-                    telegram_username=transaction.payment_data.get("telegram_username"),
-                    db=db
-                )
-                
-                if telegram_result["success"]:
-                    logger.info(f"Telegram access granted for user {user.id}")
-                else:
-                    logger.warning(f"Failed to grant Telegram access for user {user.id}: {telegram_result.get('error')}")
-            
             logger.info(f"Subscription activated for user {user.id}: {transaction.plan_id}")
             
         except Exception as e:
             logger.error(f"Error activating subscription: {e}")
             raise
     
-    async def get_subscription_plans(self, db: AsyncSession) -> List[Dict[str, Any]]:
-        """Get available subscription plans."""
+    async def _post_webhook_work(self, transaction_id: int, status: str, failure_reason: str):
+        """Record the payment event and grant Telegram access after a webhook was acknowledged."""
+        from dependencies import AsyncSessionLocal
+        
         try:
-            # Get plans from database
-            result = await db.execute(select(SubscriptionPlan).where(SubscriptionPlan.is_active == True))
-            db_plans = result.scalars().all()
-            
-            # Convert to dict format
-            plans = []
-            for plan in db_plans:
-                plans.append({
-                    "id": plan.id,
-                    "name": plan.name,
-                    "price_usd": float(plan.price_usd),
-                    "price_usdt": float(plan.price_usdt),
-                    "interval": plan.interval,
-                    "duration_days": plan.duration_days,
-                    "dashboard_access_limit": plan.dashboard_access_limit,
-                    "features": plan.features,
-                    "telegram_access": plan.telegram_access,
-                    "support_level": plan.support_level,
-                    "binance_pay_id": plan.binance_pay_id,
-                    "is_active": plan.is_active
-                })
-            
-            return plans
-            
+            async with AsyncSessionLocal() as db:
+                transaction = await db.get(
+                    PaymentTransaction, transaction_id, options=[joinedload(PaymentTransaction.user)]
+                )
+                user = transaction.user
+                
+                if status == "SUCCESS":
+                    event = SubscriptionEvent(
+                        user_id=user.id,
+                        event_type="payment_completed",
+                        event_data={
+                            "plan_id": transaction.plan_id,
+                            "amount_usdt": float(transaction.amount_usdt),
+                            "payment_id": transaction.transaction_id,
+                            "transaction_id": transaction.id
+                        },
+                        processed=True
+                    )
+                else:
+                    event = SubscriptionEvent(
+                        user_id=user.id,
+                        event_type="payment_failed",
+                        event_data={
+                            "plan_id": transaction.plan_id,
+                            "payment_id": transaction.transaction_id,
+                            "failure_reason": failure_reason
+                        },
+                        processed=True
+                    )
+                db.add(event)
+                await db.commit()
+                
+                # Grant Telegram access if applicable
+                plan = self.subscription_plans[transaction.plan_id]
+                payment_data = transaction.payment_data or {}
+                if status == "SUCCESS" and plan["telegram_access"] and payment_data.get("telegram_user_id"):
+                    # Import and use Telegram group manager
+                    from services.telegram_group_manager import telegram_group_manager
+                    
+                    telegram_result = await telegram_group_manager.grant_telegram_access(
+                        user=user,
+                        subscription_tier=transaction.plan_id,
+                        telegram_user_id=payment_data["telegram_user_id"],
+                        telegram_username=payment_data.get("telegram_username"),
+                        db=db
+                    )
+                    
+                    if telegram_result["success"]:
+                        logger.info(f"Telegram access granted for user {user.id}")
+                    else:
+                        logger.warning(f"Failed to grant Telegram access for user {user.id}: {telegram_result.get('error')}")
+                        
         except Exception as e:
-            logger.error(f"Error getting subscription plans: {e}")
-            return []
+            logger.error(f"Error in post-webhook processing for transaction {transaction_id}: {e}")
+    
+    async def get_subscription_plans(self, db: AsyncSession) -> List[Dict[str, Any]]:
+        """Get available subscription plans."""
+        # Plans change at most per deploy, so serve them from memory between refreshes
+        if self._plans_cache and time.monotonic() - self._plans_cache[0] < _PLANS_CACHE_TTL:
+            return self._plans_cache[1]
+        
+        async with self._plans_lock:
+            # Another request may have refreshed the cache while we waited
+            if self._plans_cache and time.monotonic() - self._plans_cache[0] < _PLANS_CACHE_TTL:
+                return self._plans_cache[1]
+            
+            try:
+                # Get plans from database
+                result = await db.execute(_SELECT_ACTIVE_PLANS)
+                db_plans = result.scalars().all()
+                
+                # Convert to dict format
+                plans = [
+                    {
+                        "id": plan.id,
+                        "name": plan.name,
+                        "price_usd": float(plan.price_usd),
+                        "price_usdt": float(plan.price_usdt),
+                        "interval": plan.interval,
+                        "duration_days": plan.duration_days,
+                        "dashboard_access_limit": plan.dashboard_access_limit,
+                        "features": plan.features,
+                        "telegram_access": plan.telegram_access,
+                        "support_level": plan.support_level,
+                        "binance_pay_id": plan.binance_pay_id,
+                        "is_active": plan.is_active
+                    }
+                    for plan in db_plans
+                ]
+                
+                self._plans_cache = (time.monotonic(), plans)
+                return plans
+                
+            except Exception as e:
+                logger.error(f"Error getting subscription plans: {e}")
+                return []
     
     async def check_payment_status(self, payment_id: str, db: AsyncSession) -> Dict[str, Any]:
         """Check payment status."""
         try:
             result = await db.execute(
-                select(PaymentTransaction).where(PaymentTransaction.transaction_id == payment_id)
+                _SELECT_TRANSACTION, {"transaction_id": payment_id}
             )
             transaction = result.scalar_one_or_none()
             
@@ -4,10 +4,13 @@ Manages Telegram group memberships based on subscription tiers
 """
 
 import asyncio
+from dataclasses import asdict, dataclass
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
-from sqlalchemy import select, and_
+import httpx
+from sqlalchemy import bindparam, select, and_, or_, func, insert, text, update
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import sys
@@ -18,30 +21,87 @@ from common.logging import get_logger
 
 logger = get_logger(__name__)
 
+# Insert an access row and its "granted" event in one round trip. ON CONFLICT
+# relies on the partial unique index on (user_id, group_name) WHERE is_active.
+_GRANT_ACCESS_WITH_EVENT = text("""
+    WITH granted AS (
+        INSERT INTO telegram_group_access
+            (user_id, telegram_user_id, telegram_username, group_name, is_active,
+             access_granted_at, created_at, updated_at)
+        VALUES
+            (:user_id, :telegram_user_id, :telegram_username, :group_name, TRUE,
+             NOW(), NOW(), NOW())
+        ON CONFLICT (user_id, group_name) WHERE is_active DO NOTHING
+        RETURNING user_id
+    )
+    INSERT INTO subscription_events
+        (user_id, event_type, event_data, processed, created_at, updated_at)
+    SELECT user_id, 'telegram_access_granted', :event_data, TRUE, NOW(), NOW()
+    FROM granted
+    RETURNING id
+""").bindparams(bindparam("event_data", type_=JSONB))
+
+# Maximum concurrent Telegram Bot API calls (Telegram allows ~30 messages/second)
+TELEGRAM_API_CONCURRENCY = 25
+
+
+@dataclass(frozen=True, slots=True)
+class GroupConfig:
+    """Telegram group configuration for a subscription tier."""
+    group_name: str
+    group_id: str
+    group_title: str
+    description: str
+
 
 class TelegramGroupManager:
     """Manages Telegram group access based on subscription tiers."""
     
     def __init__(self):
         # Telegram group configurations
-        self.group_configs = {
-            "professional": {
-                "group_name": "professional_group",
-                "group_id": "@winu_professional",  # Replace with actual group ID
-                "group_title": "Winu Professional Trading Group",
-                "description": "Professional subscribers trading signals and discussions"
-            },
-            "vip_elite": {
-                "group_name": "vip_elite_group", 
-                "group_id": "@winu_vip_elite",  # Replace with actual group ID
-                "group_title": "Winu VIP Elite Trading Group",
-                "description": "VIP Elite subscribers exclusive trading signals and 24/7 support"
-            }
+        self.group_configs: Dict[str, GroupConfig] = {
+            "professional": GroupConfig(
+                group_name="professional_group",
+                group_id="@winu_professional",  # Replace with actual group ID
+                group_title="Winu Professional Trading Group",
+                description="Professional subscribers trading signals and discussions"
+            ),
+            "vip_elite": GroupConfig(
+                group_name="vip_elite_group",
+                group_id="@winu_vip_elite",  # Replace with actual group ID
+                group_title="Winu VIP Elite Trading Group",
+                description="VIP Elite subscribers exclusive trading signals and 24/7 support"
+            )
         }
         
+        # Reverse lookup: group_name -> (tier, config)
+        self._by_group_name = {
+            config.group_name: (tier, config)
+            for tier, config in self.group_configs.items()
+        }
+        
+        # (subscription_tier, group_name) pairs that grant access
+        self._eligible_pairs = frozenset(
+            (tier, config.group_name) for tier, config in self.group_configs.items()
+        )
+        
+        # SQL form of _check_telegram_access_eligibility for set-based checks
+        self._eligible_clause = and_(
+            User.subscription_status == "active",
+            User.access_revoked_at.is_(None),
+            or_(*(
+                and_(
+                    User.subscription_tier == tier,
+                    TelegramGroupAccess.group_name == group_name
+                )
+                for tier, group_name in self._eligible_pairs
+            ))
+        )
+        
         # Bot token for Telegram API (would be loaded from environment)
         self.bot_token = None  # Load from environment variables
         self.bot_username = "winu_trading_bot"  # Replace with actual bot username
+        self._client: Optional[httpx.AsyncClient] = None
     
     async def grant_telegram_access(
         self, 
@@ -61,50 +121,30 @@ class TelegramGroupManager:
             
             group_config = self.group_configs[subscription_tier]
             
-            # Check if user already has access to this group
-            result = await db.execute(
-                select(TelegramGroupAccess).where(
-                    and_(
-                        TelegramGroupAccess.user_id == user.id,
-                        TelegramGroupAccess.group_name == group_config["group_name"],
-                        TelegramGroupAccess.is_active == True
-                    )
-                )
-            )
-            existing_access = result.scalar_one_or_none()
+            # Create the access record (unless an active one already exists) and
+            # its subscription event in one statement; no row back means the
+            # user already had access
+            result = await db.execute(_GRANT_ACCESS_WITH_EVENT, {
+                "user_id": user.id,
+                "telegram_user_id": telegram_user_id,
+                "telegram_username": telegram_username,
+                "group_name": group_config.group_name,
+                "event_data": {
+                    "group_name": group_config.group_name,
+                    "group_id": group_config.group_id,
+                    "subscription_tier": subscription_tier,
+                    "telegram_user_id": telegram_user_id,
+                    "telegram_username": telegram_username
+                }
+            })
             
-            if existing_access:
+            if result.scalar_one_or_none() is None:
                 return {
                     "success": True,
                     "message": "User already has access to this group",
-                    "group_info": group_config
+                    "group_info": asdict(group_config)
                 }
             
-            # Create Telegram group access record
-            telegram_access = TelegramGroupAccess(
-                user_id=user.id,
-                telegram_user_id=telegram_user_id,
-                telegram_username=telegram_username,
-                group_name=group_config["group_name"],
-                is_active=True
-            )
-            db.add(telegram_access)
-            
-            # Create subscription event
-            event = SubscriptionEvent(
-                user_id=user.id,
-                event_type="telegram_access_granted",
-                event_data={
-                    "group_name": group_config["group_name"],
-                    "group_id": group_config["group_id"],
-                    "subscription_tier": subscription_tier,
-                    "telegram_user_id": telegram_user_id,
-                    "telegram_username": telegram_username
-                },
-                processed=True
-            )
-            db.add(event)
-            
             await db.commit()
             
             # Send Telegram invitation (if bot is configured)
@@ -119,7 +159,7 @@ class TelegramGroupManager:
             return {
                 "success": True,
                 "message": f"Telegram access granted to {subscription_tier} group",
-                "group_info": group_config,
+                "group_info": asdict(group_config),
                 "invitation_sent": invitation_sent
             }
             
@@ -145,11 +185,12 @@ class TelegramGroupManager:
             
             conditions.append(TelegramGroupAccess.is_active == True)
             
-            # Get active Telegram access records
+            # Get active Telegram access records (only the columns needed)
             result = await db.execute(
-                select(TelegramGroupAccess).where(and_(*conditions))
+                select(TelegramGroupAccess.id, TelegramGroupAccess.group_name)
+                .where(and_(*conditions))
             )
-            telegram_accesses = result.scalars().all()
+            telegram_accesses = result.all()
             
             if not telegram_accesses:
                 return {
@@ -157,27 +198,14 @@ class TelegramGroupManager:
                     "message": "No active Telegram access found"
                 }
             
-            revoked_groups = []
+            revoked_groups = [access.group_name for access in telegram_accesses]
             
-            for access in telegram_accesses:
-                # Mark access as inactive
-                access.is_active = False
-                access.access_revoked_at = datetime.utcnow()
-                
-                revoked_groups.append(access.group_name)
-                
-                # Create revocation event
-                event = SubscriptionEvent(
-                    user_id=user.id,
-                    event_type="telegram_access_revoked",
-                    event_data={
-                        "group_name": access.group_name,
-                        "revoked_at": access.access_revoked_at.isoformat(),
-                        "reason": "subscription_expired_or_revoked"
-                    },
-                    processed=True
-                )
-                db.add(event)
+            # Mark all records inactive and create revocation events in bulk
+            await self._revoke_accesses(
+                [access.id for access in telegram_accesses],
+                [(user.id, group) for group in revoked_groups],
+                db
+            )
             
             await db.commit()
             
@@ -206,11 +234,16 @@ class TelegramGroupManager:
         """Get user's Telegram group access information."""
         try:
             result = await db.execute(
-                select(TelegramGroupAccess).where(
+                select(
+                    TelegramGroupAccess.group_name,
+                    TelegramGroupAccess.access_granted_at,
+                    TelegramGroupAccess.access_revoked_at,
+                    TelegramGroupAccess.is_active
+                ).where(
                     TelegramGroupAccess.user_id == user.id
                 ).order_by(TelegramGroupAccess.created_at.desc())
             )
-            telegram_accesses = result.scalars().all()
+            telegram_accesses = result.all()
             
             access_info = {
                 "user_id": user.id,
@@ -230,14 +263,14 @@ class TelegramGroupManager:
                 }
                 
                 # Add group configuration if available
-                for tier, config in self.group_configs.items():
-                    if config["group_name"] == access.group_name:
-                        group_info.update({
-                            "group_id": config["group_id"],
-                            "group_title": config["group_title"],
-                            "subscription_tier": tier
-                        })
-                        break
+                hit = self._by_group_name.get(access.group_name)
+                if hit:
+                    tier, config = hit
+                    group_info.update({
+                        "group_id": config.group_id,
+                        "group_title": config.group_title,
+                        "subscription_tier": tier
+                    })
                 
                 if access.is_active:
                     access_info["active_groups"].append(group_info)
@@ -255,50 +288,74 @@ class TelegramGroupManager:
         try:
             logger.info("Starting Telegram membership sync...")
             
-            # Get all active Telegram access records
+            total_records = await db.scalar(
+                select(func.count())
+                .select_from(TelegramGroupAccess)
+                .where(TelegramGroupAccess.is_active == True)
+            )
+            
+            # Active records whose user no longer exists or whose subscription
+            # no longer allows access, filtered by the database
             result = await db.execute(
-                select(TelegramGroupAccess).where(
-                    TelegramGroupAccess.is_active == True
+                select(
+                    TelegramGroupAccess.id,
+                    TelegramGroupAccess.user_id,
+                    TelegramGroupAccess.group_name,
+                    TelegramGroupAccess.telegram_user_id,
+                    User.id.label("existing_user_id")
+                )
+                .outerjoin(User, User.id == TelegramGroupAccess.user_id)
+                .where(
+                    and_(
+                        TelegramGroupAccess.is_active == True,
+                        or_(User.id.is_(None), self._eligible_clause.is_not(True))
+                    )
                 )
             )
-            active_accesses = result.scalars().all()
+            to_revoke = result.all()
             
             sync_results = {
-                "total_records": len(active_accesses),
+                "total_records": total_records,
                 "synced": 0,
                 "errors": []
             }
             
-            for access in active_accesses:
+            if to_revoke:
                 try:
-                    # Verify user still has valid subscription
-                    user_result = await db.execute(
-                        select(User).where(User.id == access.user_id)
+                    # Events reference users, so skip rows whose user no longer exists
+                    await self._revoke_accesses(
+                        [row.id for row in to_revoke],
+                        [
+                            (row.user_id, row.group_name) for row in to_revoke
+                            if row.existing_user_id is not None
+                        ],
+                        db
                     )
-                    user = user_result.scalar_one_or_none()
-                    
-                    if not user:
-                        # User not found, revoke access
-                        await self.revoke_telegram_access(
-                            type('User', (), {'id': access.user_id})(),
-                            access.group_name,
-                            db
-                        )
-                        sync_results["synced"] += 1
-                        continue
-                    
-                    # Check if user's subscription still allows Telegram access
-                    if not await self._check_telegram_access_eligibility(user, access.group_name):
-                        # Revoke access
-                        await self.revoke_telegram_access(user, access.group_name, db)
-                        sync_results["synced"] += 1
-                        continue
-                    
-                    sync_results["synced"] += 1
-                    
+                    await db.commit()
                 except Exception as e:
-                    logger.error(f"Error syncing access for user {access.user_id}: {e}")
-                    sync_results["errors"].append(f"User {access.user_id}: {str(e)}")
+                    logger.error(f"Error revoking Telegram access during sync: {e}")
+                    await db.rollback()
+                    sync_results["errors"].extend(
+                        f"User {row.user_id}: {str(e)}" for row in to_revoke
+                    )
+                    to_revoke = []
+                
+                # Remove from Telegram groups (if bot is configured), overlapping
+                # the API calls while staying under Telegram's rate limit
+                semaphore = asyncio.Semaphore(TELEGRAM_API_CONCURRENCY)
+                
+                async def remove(row) -> bool:
+                    async with semaphore:
+                        return await self._remove_from_telegram_group(
+                            row.telegram_user_id, row.group_name
+                        )
+                
+                await asyncio.gather(
+                    *(remove(row) for row in to_revoke),
+                    return_exceptions=True
+                )
+            
+            sync_results["synced"] = total_records - len(sync_results["errors"])
             
             logger.info(f"Telegram membership sync completed: {sync_results}")
             return sync_results
@@ -307,36 +364,85 @@ class TelegramGroupManager:
             logger.error(f"Error in Telegram membership sync: {e}")
             return {"error": str(e)}
     
+    async def _revoke_accesses(
+        self,
+        access_ids: List[int],
+        events: List[Tuple[int, str]],
+        db: AsyncSession
+    ) -> datetime:
+        """Deactivate access rows and record (user_id, group_name) revocation events in bulk (caller commits)."""
+        now = datetime.utcnow()
+        
+        await db.execute(
+            update(TelegramGroupAccess)
+            .where(TelegramGroupAccess.id.in_(access_ids))
+            .values(is_active=False, access_revoked_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        
+        if events:
+            await db.execute(
+                insert(SubscriptionEvent),
+                [
+                    {
+                        "user_id": user_id,
+                        "event_type": "telegram_access_revoked",
+                        "event_data": {
+                            "group_name": group_name,
+                            "revoked_at": now.isoformat(),
+                            "reason": "subscription_expired_or_revoked"
+                        },
+                        "processed": True
+                    }
+                    for user_id, group_name in events
+                ]
+            )
+        
+        return now
+    
     async def _check_telegram_access_eligibility(self, user: User, group_name: str) -> bool:
         """Check if user is eligible for Telegram group access."""
         try:
-            # Check subscription tier
-            if user.subscription_tier not in ["professional", "vip_elite"]:
-                return False
-            
-            # Check subscription status
-            if user.subscription_status != "active":
-                return False
-            
-            # Check if payment is overdue
-            if user.access_revoked_at:
-                return False
-            
-            # Check if group matches subscription tier
-            for tier, config in self.group_configs.items():
-                if config["group_name"] == group_name:
-                    return user.subscription_tier == tier
-            
-            return False
+            # Subscription must be active, not revoked for overdue payment,
+            # and its tier must match the group
+            return (
+                user.subscription_status == "active"
+                and not user.access_revoked_at
+                and (user.subscription_tier, group_name) in self._eligible_pairs
+            )
             
         except Exception as e:
             logger.error(f"Error checking Telegram access eligibility: {e}")
             return False
     
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the shared Telegram Bot API client (one HTTP/2 connection for all calls)."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=f"https://api.telegram.org/bot{self.bot_token}/",
+                http2=True,
+                timeout=10.0
+            )
+        return self._client
+    
+    async def close(self):
+        """Close the shared Telegram Bot API client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _call_bot_api(self, method: str, data: Dict[str, Any]) -> bool:
+        """Call a Telegram Bot API method and report whether it succeeded."""
+        response = await self._get_client().post(method, json=data)
+        if response.status_code != 200:
+            logger.warning(f"Telegram {method} failed ({response.status_code}): {response.text}")
+            return False
+        return True
+    
     async def _send_telegram_invitation(
         self, 
         telegram_user_id: str, 
-        group_config: Dict[str, str],
+        group_config: GroupConfig,
         subscription_tier: str
     ) -> bool:
         """Send Telegram group invitation to user."""
@@ -345,23 +451,15 @@ class TelegramGroupManager:
                 logger.warning("Telegram bot token not configured, skipping invitation")
                 return False
             
-            # This would integrate with the Telegram Bot API
-            # For now, we'll just log the action
-            
-            logger.info(f"Telegram invitation sent to user {telegram_user_id} for {group_config['group_title']}")
+            sent = await self._call_bot_api("sendMessage", {
+                "chat_id": telegram_user_id,
+                "text": f"Welcome to {group_config.group_title}! Your {subscription_tier} subscription is now active.",
+                "parse_mode": "HTML"
+            })
             
-            # Example implementation:
-            # import requests
-            # url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
-            # data = {
-            #     "chat_id": telegram_user_id,
-            #     "text": f"Welcome to {group_config['group_title']}! Your {subscription_tier} subscription is now active.",
-            #     "parse_mode": "HTML"
-            # }
-            # response = requests.post(url, data=data)
-            # return response.status_code == 200
-            
-            return True
+            if sent:
+                logger.info(f"Telegram invitation sent to user {telegram_user_id} for {group_config.group_title}")
+            return sent
             
         except Exception as e:
             logger.error(f"Error sending Telegram invitation: {e}")
@@ -374,25 +472,25 @@ class TelegramGroupManager:
                 logger.warning("Telegram bot token not configured, skipping removal")
                 return False
             
-            # This would integrate with the Telegram Bot API
-            # For now, we'll just log the action
-            
-            logger.info(f"User {telegram_user_id} removed from {group_name}")
-            
-            # Example implementation:
-            # import requests
-            # group_config = self.group_configs.get(group_name, {})
-            # group_id = group_config.get("group_id")
-            # if group_id:
-            #     url = f"https://api.telegram.org/bot{self.bot_token}/kickChatMember"
-            #     data = {
-            #         "chat_id": group_id,
-            #         "user_id": telegram_user_id
-            #     }
-            #     response = requests.post(url, data=data)
-            #     return response.status_code == 200
+            hit = self._by_group_name.get(group_name)
+            if not hit:
+                logger.warning(f"Unknown Telegram group {group_name}, skipping removal")
+                return False
             
-            return True
+            # Ban then immediately unban so the user is removed but can rejoin later
+            group_id = hit[1].group_id
+            removed = await self._call_bot_api("banChatMember", {
+                "chat_id": group_id,
+                "user_id": telegram_user_id
+            }) and await self._call_bot_api("unbanChatMember", {
+                "chat_id": group_id,
+                "user_id": telegram_user_id,
+                "only_if_banned": True
+            })
+            
+            if removed:
+                logger.info(f"User {telegram_user_id} removed from {group_name}")
+            return removed
             
         except Exception as e:
             logger.error(f"Error removing user from Telegram group: {e}")
@@ -401,25 +499,29 @@ class TelegramGroupManager:
     async def get_group_statistics(self, db: AsyncSession) -> Dict[str, Any]:
         """Get Telegram group statistics."""
         try:
-            stats = {}
+            group_names = [config.group_name for config in self.group_configs.values()]
             
-            for tier, config in self.group_configs.items():
-                # Count active members
-                result = await db.execute(
-                    select(TelegramGroupAccess).where(
-                        and_(
-                            TelegramGroupAccess.group_name == config["group_name"],
-                            TelegramGroupAccess.is_active == True
-                        )
+            # Count active members for all groups in one query
+            result = await db.execute(
+                select(TelegramGroupAccess.group_name, func.count())
+                .where(
+                    and_(
+                        TelegramGroupAccess.is_active == True,
+                        TelegramGroupAccess.group_name.in_(group_names)
                     )
                 )
-                active_members = len(result.scalars().all())
-                
-                stats[config["group_name"]] = {
-                    "group_title": config["group_title"],
-                    "group_id": config["group_id"],
+                .group_by(TelegramGroupAccess.group_name)
+            )
+            member_counts = dict(result.all())
+            
+            stats = {}
+            
+            for tier, config in self.group_configs.items():
+                stats[config.group_name] = {
+                    "group_title": config.group_title,
+                    "group_id": config.group_id,
                     "subscription_tier": tier,
-                    "active_members": active_members
+                    "active_members": member_counts.get(config.group_name, 0)
                 }
             
             return stats
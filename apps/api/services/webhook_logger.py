@@ -6,8 +6,8 @@ Logs all incoming payment webhooks for debugging and monitoring
 from datetime import datetime
 from typing import Dict, Any, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import text
-import json
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import JSONB
 import logging
 
 logger = logging.getLogger(__name__)
@@ -28,6 +28,9 @@ async def log_webhook(
     """
     Log an incoming webhook to the database.
     
+    The row is flushed, not committed: the caller owns the transaction and
+    commits it together with its own changes.
+    
     Args:
         db: Database session
         payment_method: Payment method (coinbase_commerce, nowpayments, etc.)
@@ -44,25 +47,26 @@ async def log_webhook(
         webhook_log_id: ID of the created webhook log entry
     """
     try:
-        # Convert dicts to JSON strings
-        webhook_data_json = json.dumps(webhook_data)
-        headers_json = json.dumps(headers) if headers else None
-        
+        # JSONB parameters are serialized once by the engine's JSON serializer,
+        # so the payload is bound directly without a text CAST
         query = text("""
             INSERT INTO webhook_logs 
             (payment_method, webhook_type, webhook_data, headers, signature, 
              signature_valid, processing_status, user_id, payment_id, plan_id, created_at)
             VALUES 
-            (:payment_method, :webhook_type, CAST(:webhook_data AS jsonb), CAST(:headers AS jsonb), :signature,
+            (:payment_method, :webhook_type, :webhook_data, :headers, :signature,
              :signature_valid, 'received', :user_id, :payment_id, :plan_id, NOW())
             RETURNING id
-        """)
+        """).bindparams(
+            bindparam("webhook_data", type_=JSONB),
+            bindparam("headers", type_=JSONB(none_as_null=True))
+        )
         
         result = await db.execute(query, {
             "payment_method": payment_method,
             "webhook_type": webhook_type,
-            "webhook_data": webhook_data_json,
-            "headers": headers_json,
+            "webhook_data": webhook_data,
+            "headers": headers or None,
             "signature": signature,
             "signature_valid": signature_valid,
             "user_id": user_id,
@@ -71,7 +75,6 @@ async def log_webhook(
         })
         
         webhook_log_id = result.scalar_one()
-        await db.commit()
         
         logger.info(f"📝 Webhook logged: {payment_method} - {webhook_type} - ID: {webhook_log_id}")
         return webhook_log_id
@@ -89,7 +92,7 @@ async def update_webhook_status(
     error_message: Optional[str] = None
 ):
     """
-    Update the processing status of a webhook log.
+    Update the processing status of a webhook log (not committed, see log_webhook).
     
     Args:
         db: Database session
@@ -111,14 +114,13 @@ async def update_webhook_status(
             "webhook_log_id": webhook_log_id
         })
         
-        await db.commit()
-        
         status_emoji = "✅" if status == "completed" else "❌" if status == "failed" else "⏳"
         logger.info(f"{status_emoji} Webhook {webhook_log_id} status: {status}")
         
     except Exception as e:
+        # The caller owns the transaction and must see that it is now aborted
         logger.error(f"❌ Error updating webhook status: {e}")
-        await db.rollback()
+        raise
 
 
 async def get_recent_webhook_logs(
@@ -137,10 +139,10 @@ async def get_recent_webhook_logs(
         status: Filter by processing status (optional)
         
     Returns:
-        List of webhook log dictionaries
+        List of webhook log rows (use attribute access, or row._mapping for a dict)
     """
     try:
-        filters = ["created_at >= NOW() - INTERVAL ':minutes minutes'"]
+        filters = ["created_at >= NOW() - (:minutes * INTERVAL '1 minute')"]
         params = {"minutes": minutes}
         
         if payment_method:
@@ -165,9 +167,7 @@ async def get_recent_webhook_logs(
         """)
         
         result = await db.execute(query, params)
-        rows = result.fetchall()
-        
-        return [dict(row._mapping) for row in rows]
+        return result.all()
         
     except Exception as e:
         logger.error(f"❌ Error fetching webhook logs: {e}")
@@ -183,7 +183,7 @@ async def get_failed_webhooks(db: AsyncSession, hours: int = 24) -> list:
         hours: How many hours back to look
         
     Returns:
-        List of failed webhook log dictionaries
+        List of failed webhook log rows (use attribute access, or row._mapping for a dict)
     """
     try:
         query = text("""
@@ -193,14 +193,12 @@ async def get_failed_webhooks(db: AsyncSession, hours: int = 24) -> list:
                 created_at, processed_at
             FROM webhook_logs
             WHERE processing_status = 'failed'
-            AND created_at >= NOW() - INTERVAL ':hours hours'
+            AND created_at >= NOW() - (:hours * INTERVAL '1 hour')
             ORDER BY created_at DESC
         """)
         
         result = await db.execute(query, {"hours": hours})
-        rows = result.fetchall()
-        
-        return [dict(row._mapping) for row in rows]
+        return result.all()
         
     except Exception as e:
         logger.error(f"❌ Error fetching failed webhooks: {e}")
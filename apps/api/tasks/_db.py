@@ -0,0 +1,45 @@
+"""
+Database access for Celery tasks
+One async engine per worker process, created lazily on the worker's
+persistent event loop so pooled connections survive between task runs
+"""
+
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import sys
+sys.path.append('/packages')
+
+from common.config import get_settings
+
+_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[sessionmaker] = None
+
+
+def get_engine() -> AsyncEngine:
+    """Get the worker's async engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        settings = get_settings()
+        _engine = create_async_engine(
+            settings.database.url,
+            pool_size=2,
+            max_overflow=8,
+            pool_recycle=300,
+            pool_pre_ping=True,
+            # Short batch queries gain nothing from JIT compilation
+            connect_args={"server_settings": {"jit": "off"}}
+        )
+    return _engine
+
+
+def get_session() -> AsyncSession:
+    """Open a session bound to the worker's engine."""
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = sessionmaker(
+            get_engine(), class_=AsyncSession, expire_on_commit=False
+        )
+    return _session_factory()
@@ -4,20 +4,58 @@ Handles scheduled billing processes and overdue payment checks
 """
 
 from celery import Celery
+from celery.signals import worker_process_init
 from datetime import datetime, timedelta
 import asyncio
 
+try:
+    import uvloop
+except ImportError:  # uvloop is optional (not available on Windows)
+    uvloop = None
+
 import sys
 sys.path.append('/packages')
 
 from common.logging import get_logger
 from services.billing_manager import billing_manager
+from tasks._db import get_session
 
 logger = get_logger(__name__)
 
 # Initialize Celery (this would be configured with your Redis/RabbitMQ broker)
 celery_app = Celery('winu_billing', broker='redis://localhost:6379/0')
 
+# One event loop per worker process, reused by every task so the async
+# database pool keeps its connections between runs
+_loop = None
+
+
+@worker_process_init.connect
+def _init_worker_loop(**kwargs):
+    """Create the worker's persistent event loop."""
+    _get_loop()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None or _loop.is_closed():
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+
+def _run(coro):
+    """Run a coroutine to completion on the worker's event loop."""
+    return _get_loop().run_until_complete(coro)
+
+
+async def _with_session(method):
+    """Call a billing manager method with a session from the worker's pool."""
+    async with get_session() as db:
+        return await method(db)
+
 
 @celery_app.task
 def run_monthly_billing_task():
@@ -26,11 +64,7 @@ def run_monthly_billing_task():
         logger.info("Starting monthly billing task...")
         
         # Run the async billing process
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        result = loop.run_until_complete(billing_manager.process_monthly_billing())
-        loop.close()
+        result = _run(_with_session(billing_manager.process_monthly_billing))
         
         logger.info(f"Monthly billing task completed: {result}")
         return result
@@ -47,11 +81,7 @@ def check_overdue_payments_task():
         logger.info("Starting overdue payments check task...")
         
         # Run the async overdue check process
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        result = loop.run_until_complete(billing_manager._check_overdue_payments())
-        loop.close()
+        result = _run(_with_session(billing_manager._check_overdue_payments))
         
         logger.info(f"Overdue payments check task completed: {result}")
         return result
@@ -82,13 +112,12 @@ def send_payment_reminders_task():
 def cleanup_expired_trials_task():
     """Celery task to clean up expired trials."""
     try:
-        logger.info("Starting expired trials cleanup task...")
-        
-        # This would handle users whose trials have expired
-        # and ensure they can't access the system
+        # Cheap when there is nothing to do: one indexed SKIP LOCKED select
+        result = _run(_with_session(billing_manager.cleanup_expired_trials))
         
-        logger.info("Expired trials cleanup task completed")
-        return {"success": True, "trials_cleaned": 0}
+        if result.get("trials_cleaned"):
+            logger.info(f"Expired trials cleanup task completed: {result}")
+        return result
         
     except Exception as e:
         logger.error(f"Error in expired trials cleanup task: {e}")
@@ -4,24 +4,137 @@ Winu Bot Signal Metrics Exporter
 Exports custom metrics to Prometheus for Grafana visualization
 """
 
+import asyncio
 import time
-import requests
+import aiohttp
 import json
+import socket
 import sys
 import os
-from datetime import datetime, timedelta
-from prometheus_client import start_http_server, Gauge, Counter, Histogram, Info
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import HTTPServer
+from prometheus_client import Gauge, Counter, Histogram, Info, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.exposition import MetricsHandler
 import logging
 
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    json_loads = json.loads
+    
+    def json_dumps(obj):
+        return json.dumps(obj).encode()
+
+# Failures expected from an API call: transport errors, timeouts and undecodable bodies
+REQUEST_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ValueError)
+
+# Returned by _get when the API confirms the cached payload with 304 Not Modified
+NOT_MODIFIED = object()
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class MetricsHTTPServer(HTTPServer):
+    """Metrics HTTP server serving connections from a fixed thread pool with Nagle disabled"""
+    
+    def __init__(self, server_address, handler_class, max_workers=4):
+        super().__init__(server_address, handler_class)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='metrics-http')
+    
+    def get_request(self):
+        request, client_address = super().get_request()
+        # Small responses; send the final segment without waiting for an ACK
+        request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return request, client_address
+    
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_in_pool, request, client_address)
+    
+    def _process_request_in_pool(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class CachedMetricsHandler(MetricsHandler):
+    """MetricsHandler that reuses the rendered exposition for scrapes within CACHE_TTL"""
+    
+    CACHE_TTL = 1.0
+    _cache_lock = threading.Lock()
+    _cache_at = 0.0
+    _cache_body = b''
+    
+    @classmethod
+    def _exposition(cls):
+        with cls._cache_lock:
+            now = time.monotonic()
+            if not cls._cache_body or now - cls._cache_at >= cls.CACHE_TTL:
+                cls._cache_body = generate_latest(REGISTRY)
+                cls._cache_at = now
+            return cls._cache_body
+    
+    def do_GET(self):
+        # Filtered (name[]=...) scrapes go through the uncached handler
+        if '?' in self.path:
+            return super().do_GET()
+        
+        body = self._exposition()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE_LATEST)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port, addr='0.0.0.0'):
+    """Serve the default Prometheus registry on a background thread"""
+    httpd = MetricsHTTPServer((addr, port), CachedMetricsHandler)
+    threading.Thread(target=httpd.serve_forever, name='metrics-server', daemon=True).start()
+    return httpd
+
+
 class WinuBotMetricsExporter:
+    # Longest a cached payload is served after the API stops answering (seconds)
+    STALE_PAYLOAD_MAX_AGE = 600
+    # Minimum time between automatic data ingestion triggers (seconds)
+    INGEST_COOLDOWN = 15 * 60
+    # Last good status payload, used to seed the gauges after a restart
+    STATUS_CACHE_PATH = os.getenv('METRICS_CACHE_PATH', '/tmp/winu_metrics_cache.json')
+    
     def __init__(self, api_base="http://winu-bot-signal-api:8001", port=8002):
         self.api_base = api_base
         self.port = port
         
+        # Shared keep-alive session and trigger queue, created by run_metrics_loop
+        self.aio_session = None
+        self.triggers = None
+        
+        # path -> (monotonic fetch time, payload); TTL follows the scrape interval
+        self._cache = {}
+        # path -> ETag of the cached payload, revalidated with If-None-Match
+        self._etags = {}
+        self._cache_ttl = 15
+        
+        # Values last published to the Info metrics, to skip unchanged republishing
+        self._last_signal_key = None
+        self._last_sysinfo_key = None
+        
+        # Monotonic time of the last automatic ingestion trigger
+        self._last_ingest_trigger = None
+        
+        # Last data update timestamp as received and as parsed, and its age at the last scrape
+        self._last_update_str = None
+        self._last_update_epoch = None
+        self._last_hours_old = None
+        
         # Prometheus metrics
         self.api_health = Gauge('winu_api_health', 'API health status (1=healthy, 0=unhealthy)')
         self.total_candles = Gauge('winu_total_candles', 'Total number of OHLCV candles')
@@ -33,6 +146,18 @@ class WinuBotMetricsExporter:
         self.worker_warnings = Gauge('winu_worker_warnings', 'Number of worker warnings')
         self.data_freshness = Gauge('winu_data_freshness_hours', 'Hours since last data update')
         
+        # Bound setters for gauges copied straight from a status section field
+        self._ingestion_setters = (
+            ('total_candles', self.total_candles.set),
+            ('active_assets', self.active_assets.set),
+            ('total_assets', self.total_assets.set),
+        )
+        self._signal_setters = (
+            ('recent_signals', self.recent_signals.set),
+            ('signals_today', self.signals_today.set),
+        )
+        self._set_freshness = self.data_freshness.set
+        
         # Counters
         self.data_ingestion_requests = Counter('winu_data_ingestion_requests_total', 'Total data ingestion requests')
         self.signal_generation_requests = Counter('winu_signal_generation_requests_total', 'Total signal generation requests')
@@ -45,155 +170,281 @@ class WinuBotMetricsExporter:
         self.system_info = Info('winu_system_info', 'System information')
         self.latest_signal = Info('winu_latest_signal', 'Latest trading signal information')
         
-    def fetch_system_status(self):
+        # endpoint -> (success counter, error counter, response time) label children
+        self._endpoint_metrics = {}
+        self._endpoint_children('monitor/status')
+        
+    async def _fetch(self, path):
+        """GET an API endpoint through the response cache; returns the parsed JSON or None"""
+        now = time.monotonic()
+        entry = self._cache.get(path)
+        if entry and now - entry[0] < self._cache_ttl:
+            return entry[1]
+        
+        data = await self._get(path, etag=self._etags.get(path) if entry else None)
+        if data is NOT_MODIFIED:
+            data = entry[1]
+        if data is not None:
+            self._cache[path] = (now, data)
+            return data
+        
+        # Keep panels on the last known values through a short upstream blip
+        if entry and now - entry[0] < self.STALE_PAYLOAD_MAX_AGE:
+            logger.warning("Serving %s payload from %.0fs ago", path, now - entry[0])
+            return dict(entry[1], stale=True)
+        return None
+    
+    def _endpoint_children(self, path):
+        """Bound request metrics for an endpoint, resolved from the label registry once"""
+        children = self._endpoint_metrics.get(path)
+        if children is None:
+            children = self._endpoint_metrics[path] = (
+                self.api_requests.labels(endpoint=path, status='success'),
+                self.api_requests.labels(endpoint=path, status='error'),
+                self.api_response_time.labels(endpoint=path),
+            )
+        return children
+    
+    async def _get(self, path, etag=None, retries=2):
+        """GET an API endpoint and record its outcome; returns the parsed JSON, NOT_MODIFIED or None"""
+        requests_ok, requests_err, response_time = self._endpoint_children(path)
+        headers = {'If-None-Match': etag} if etag else None
+        for attempt in range(retries + 1):
+            try:
+                start_time = time.perf_counter()
+                async with self.aio_session.get(f"{self.api_base}/{path}", headers=headers, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    # Gateway errors are transient; back off briefly and retry
+                    if response.status in (502, 503, 504) and attempt < retries:
+                        await asyncio.sleep(0.2 * 2 ** attempt)
+                        continue
+                    
+                    if response.status == 304:
+                        requests_ok.inc()
+                        response_time.observe(time.perf_counter() - start_time)
+                        return NOT_MODIFIED
+                    
+                    if response.status == 200:
+                        data = json_loads(await response.read())
+                        self._etags[path] = response.headers.get('ETag')
+                        requests_ok.inc()
+                        response_time.observe(time.perf_counter() - start_time)
+                        return data
+                    
+                    requests_err.inc()
+                    logger.error("API returned status %s for %s", response.status, path)
+                    return None
+                    
+            except REQUEST_ERRORS as e:
+                requests_err.inc()
+                logger.error("Failed to fetch %s: %s", path, e)
+                return None
+    
+    async def _post(self, path):
+        """POST to an admin endpoint; returns the response status code"""
+        async with self.aio_session.post(f"{self.api_base}/{path}", timeout=aiohttp.ClientTimeout(total=30)) as response:
+            return response.status
+    
+    async def fetch_system_status(self):
         """Fetch system status from API"""
+        return await self._fetch('monitor/status')
+    
+    def _parse_last_update(self, last_update):
+        """Epoch seconds of the API's last data update, reusing the previous parse if unchanged"""
+        if last_update != self._last_update_str:
+            last_update_time = datetime.fromisoformat(last_update.replace('Z', '+00:00'))
+            if last_update_time.tzinfo is None:
+                # The API stores candle timestamps in UTC
+                last_update_time = last_update_time.replace(tzinfo=timezone.utc)
+            self._last_update_epoch = last_update_time.timestamp()
+            self._last_update_str = last_update
+        return self._last_update_epoch
+    
+    def _save_status(self, status_data):
+        """Write the last good status payload to disk for the next start"""
         try:
-            start_time = time.time()
-            response = requests.get(f"{self.api_base}/monitor/status", timeout=10)
-            response_time = time.time() - start_time
-            
-            if response.status_code == 200:
-                self.api_requests.labels(endpoint='monitor/status', status='success').inc()
-                self.api_response_time.labels(endpoint='monitor/status').observe(response_time)
-                return response.json()
-            else:
-                self.api_requests.labels(endpoint='monitor/status', status='error').inc()
-                logger.error(f"API returned status {response.status_code}")
+            tmp_path = f"{self.STATUS_CACHE_PATH}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(json_dumps(status_data))
+            os.replace(tmp_path, self.STATUS_CACHE_PATH)
+        except OSError as e:
+            logger.warning("Failed to write status cache: %s", e)
+    
+    def _load_status(self, max_age):
+        """Read the status payload saved by a previous run if it is recent enough"""
+        try:
+            if time.time() - os.path.getmtime(self.STATUS_CACHE_PATH) > max_age:
                 return None
-                
-        except Exception as e:
-            self.api_requests.labels(endpoint='monitor/status', status='error').inc()
-            logger.error(f"Failed to fetch system status: {e}")
+            with open(self.STATUS_CACHE_PATH, 'rb') as f:
+                return json_loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Failed to read status cache: %s", e)
             return None
     
     def update_metrics(self, status_data):
         """Update Prometheus metrics with system status"""
+        self._last_hours_old = None
         if not status_data:
             return
             
         try:
+            # Bind each section once; `or {}` also covers sections sent as null
+            get = status_data.get
+            health_services = (get('health') or {}).get('services') or {}
+            data_ingestion = get('data_ingestion') or {}
+            signal_generation = get('signal_generation') or {}
+            worker_logs = get('worker_logs') or {}
+            
             # API Health
-            api_healthy = status_data.get('health', {}).get('services', {}).get('api', {}).get('status') == 'healthy'
+            api_healthy = (health_services.get('api') or {}).get('status') == 'healthy'
             self.api_health.set(1 if api_healthy else 0)
             
             # Data Ingestion Metrics
-            data_ingestion = status_data.get('data_ingestion', {})
             if data_ingestion.get('status') == 'success':
-                self.total_candles.set(data_ingestion.get('total_candles', 0))
-                self.active_assets.set(data_ingestion.get('active_assets', 0))
-                self.total_assets.set(data_ingestion.get('total_assets', 0))
+                for field, set_gauge in self._ingestion_setters:
+                    set_gauge(data_ingestion.get(field, 0))
                 
                 # Calculate data freshness
                 last_update = data_ingestion.get('last_data_update')
                 if last_update:
                     try:
-                        last_update_time = datetime.fromisoformat(last_update.replace('Z', '+00:00'))
-                        hours_old = (datetime.now() - last_update_time).total_seconds() / 3600
-                        self.data_freshness.set(hours_old)
-                    except Exception as e:
-                        logger.warning(f"Failed to parse last update time: {e}")
-                        self.data_freshness.set(999)  # Very old
+                        hours_old = (time.time() - self._parse_last_update(last_update)) / 3600.0
+                        self._set_freshness(hours_old)
+                        self._last_hours_old = hours_old
+                    except (TypeError, ValueError, AttributeError) as e:
+                        logger.warning("Failed to parse last update time: %s", e)
+                        self._set_freshness(999)  # Very old
                 else:
-                    self.data_freshness.set(999)  # No data
+                    self._set_freshness(999)  # No data
             
             # Signal Generation Metrics
-            signal_generation = status_data.get('signal_generation', {})
             if signal_generation.get('status') == 'success':
-                self.recent_signals.set(signal_generation.get('recent_signals', 0))
-                self.signals_today.set(signal_generation.get('signals_today', 0))
+                for field, set_gauge in self._signal_setters:
+                    set_gauge(signal_generation.get(field, 0))
                 
                 # Latest signal info
                 latest = signal_generation.get('latest_signal')
                 if latest:
-                    self.latest_signal.info({
-                        'symbol': latest.get('symbol', 'N/A'),
-                        'direction': latest.get('direction', 'N/A'),
-                        'created_at': latest.get('created_at', 'N/A')
-                    })
+                    key = (latest.get('symbol', 'N/A'), latest.get('direction', 'N/A'), latest.get('created_at', 'N/A'))
+                    if key != self._last_signal_key:
+                        self.latest_signal.info(dict(zip(('symbol', 'direction', 'created_at'), key)))
+                        self._last_signal_key = key
             
             # Worker Logs Metrics
-            worker_logs = status_data.get('worker_logs', {})
             if worker_logs.get('status') == 'success':
                 self.worker_errors.set(1 if worker_logs.get('has_errors') else 0)
                 self.worker_warnings.set(1 if worker_logs.get('has_warnings') else 0)
             
             # System Info
-            self.system_info.info({
-                'timestamp': status_data.get('timestamp', 'N/A'),
-                'version': '1.0.0',
-                'environment': 'production'
-            })
+            sysinfo_key = get('timestamp', 'N/A')
+            if sysinfo_key != self._last_sysinfo_key:
+                self.system_info.info({
+                    'timestamp': sysinfo_key,
+                    'version': '1.0.0',
+                    'environment': 'production'
+                })
+                self._last_sysinfo_key = sysinfo_key
             
         except Exception as e:
             logger.error(f"Failed to update metrics: {e}")
     
-    def trigger_data_ingestion(self):
+    async def trigger_data_ingestion(self):
         """Trigger data ingestion and update metrics"""
         try:
-            response = requests.post(f"{self.api_base}/admin/ingest-data", timeout=30)
-            if response.status_code == 200:
+            status = await self._post('admin/ingest-data')
+            if status == 200:
                 self.data_ingestion_requests.inc()
                 logger.info("Data ingestion triggered successfully")
                 return True
             else:
-                logger.error(f"Failed to trigger data ingestion: {response.status_code}")
+                logger.error("Failed to trigger data ingestion: %s", status)
                 return False
-        except Exception as e:
-            logger.error(f"Error triggering data ingestion: {e}")
+        except REQUEST_ERRORS as e:
+            logger.error("Error triggering data ingestion: %s", e)
             return False
     
-    def trigger_signal_generation(self):
+    async def trigger_signal_generation(self):
         """Trigger signal generation and update metrics"""
         try:
-            response = requests.post(f"{self.api_base}/admin/generate-signals", timeout=30)
-            if response.status_code == 200:
+            status = await self._post('admin/generate-signals')
+            if status == 200:
                 self.signal_generation_requests.inc()
                 logger.info("Signal generation triggered successfully")
                 return True
             else:
-                logger.error(f"Failed to trigger signal generation: {response.status_code}")
+                logger.error("Failed to trigger signal generation: %s", status)
                 return False
-        except Exception as e:
-            logger.error(f"Error triggering signal generation: {e}")
+        except REQUEST_ERRORS as e:
+            logger.error("Error triggering signal generation: %s", e)
             return False
     
-    def run_metrics_loop(self, interval=30):
+    async def run_metrics_loop(self, interval=30):
         """Run the metrics collection loop"""
         logger.info(f"Starting metrics exporter on port {self.port}")
         logger.info(f"Collecting metrics every {interval} seconds")
+        self._cache_ttl = max(5, interval // 2)
+        
+        # Seed the gauges from the previous run so the first scrapes aren't empty
+        cached_status = self._load_status(max_age=interval * 4)
+        if cached_status:
+            logger.info("Seeding metrics from the cached status payload")
+            self.update_metrics(cached_status)
         
-        # Start Prometheus metrics server
-        start_http_server(self.port)
+        # Start Prometheus metrics server (serves from its own threads)
+        start_metrics_server(self.port)
         
+        connector = aiohttp.TCPConnector(limit=16, keepalive_timeout=60)
+        async with aiohttp.ClientSession(connector=connector, headers={'Accept': 'application/json'}) as session:
+            self.aio_session = session
+            self.triggers = asyncio.Queue()
+            await asyncio.gather(self._status_task(interval), self._trigger_task())
+    
+    async def _status_task(self, interval):
+        """Scrape the API status every interval and queue follow-up actions"""
+        # Ticks land on a fixed monotonic grid, so the cadence doesn't drift by the scrape time
+        next_deadline = time.monotonic() + interval
         while True:
             try:
                 # Fetch system status
-                status_data = self.fetch_system_status()
+                status_data = await self.fetch_system_status()
                 
                 # Update metrics
                 self.update_metrics(status_data)
+                if status_data and not status_data.get('stale'):
+                    self._save_status(status_data)
                 
                 # Auto-trigger actions based on metrics
-                if status_data:
-                    data_ingestion = status_data.get('data_ingestion', {})
-                    if data_ingestion.get('status') == 'success':
-                        last_update = data_ingestion.get('last_data_update')
-                        if last_update:
-                            try:
-                                last_update_time = datetime.fromisoformat(last_update.replace('Z', '+00:00'))
-                                hours_old = (datetime.now() - last_update_time).total_seconds() / 3600
-                                if hours_old > 2:  # Data is older than 2 hours
-                                    logger.info(f"Data is {hours_old:.1f} hours old, triggering refresh...")
-                                    self.trigger_data_ingestion()
-                            except Exception as e:
-                                logger.warning(f"Failed to check data freshness: {e}")
+                hours_old = self._last_hours_old
+                if hours_old is not None and hours_old > 2:  # Data is older than 2 hours
+                    # Ingestion takes a while to land; don't re-trigger every tick meanwhile
+                    now = time.monotonic()
+                    if self._last_ingest_trigger is None or now - self._last_ingest_trigger >= self.INGEST_COOLDOWN:
+                        self._last_ingest_trigger = now
+                        logger.info(f"Data is {hours_old:.1f} hours old, triggering refresh...")
+                        self.triggers.put_nowait(self.trigger_data_ingestion)
                 
                 logger.info("Metrics updated successfully")
                 
             except Exception as e:
                 logger.error(f"Error in metrics loop: {e}")
             
-            time.sleep(interval)
+            now = time.monotonic()
+            if next_deadline < now:
+                # A tick overran; resume the grid from now instead of bursting to catch up
+                next_deadline = now + interval
+            await asyncio.sleep(next_deadline - now)
+            next_deadline += interval
+    
+    async def _trigger_task(self):
+        """Run queued admin triggers one at a time, off the scrape path"""
+        while True:
+            trigger = await self.triggers.get()
+            try:
+                await trigger()
+            except Exception:
+                # Keep the trigger task alive; it shares the loop with the scraper
+                logger.exception("Unexpected error in %s", trigger.__name__)
 
 def main():
     import argparse
@@ -206,7 +457,7 @@ def main():
     args = parser.parse_args()
     
     exporter = WinuBotMetricsExporter(api_base=args.api_base, port=args.port)
-    exporter.run_metrics_loop(interval=args.interval)
+    asyncio.run(exporter.run_metrics_loop(interval=args.interval))
 
 if __name__ == "__main__":
     main()
@@ -119,66 +119,82 @@ class BalancedWinRateBacktest:
         
         return adx
     
-    def check_multi_timeframe_trend(self, df_1h: pd.DataFrame, df_4h: pd.DataFrame) -> bool:
-        """WIN RATE IMPROVEMENT #1: Relaxed multi-timeframe confirmation."""
-        if len(df_1h) < 50 or len(df_4h) < 20:
-            return True  # Allow if not enough data
-        
-        # 1H trend (more lenient)
-        ema_20_1h = df_1h['close'].ewm(span=20).mean()
-        ema_50_1h = df_1h['close'].ewm(span=50).mean()
-        trend_1h = ema_20_1h.iloc[-1] > ema_50_1h.iloc[-1]
-        
-        # 4H trend (more lenient)
-        ema_20_4h = df_4h['close'].ewm(span=20).mean()
-        ema_50_4h = df_4h['close'].ewm(span=50).mean()
-        trend_4h = ema_20_4h.iloc[-1] > ema_50_4h.iloc[-1]
-        
-        # At least one timeframe should be bullish
-        return trend_1h or trend_4h
+    def compute_indicators(self, df: pd.DataFrame, df_4h: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """Compute every indicator the filters and scoring use, once for the whole series.
+        
+        Rolling windows and EWMs only look backwards, so element i equals the value
+        computed on df.iloc[:i+1].
+        """
+        close = df['close']
+        macd_line, signal_line, _ = self.calculate_macd(close)
+        
+        # The 4H trend is taken from the latest 4H candle for every 1H bar
+        trend_4h = (len(df_4h) < 20 or
+                    df_4h['close'].ewm(span=20).mean().iloc[-1] > df_4h['close'].ewm(span=50).mean().iloc[-1])
+        
+        return {
+            'close': close.to_numpy(),
+            'volume': df['volume'].to_numpy(),
+            'volume_ma_20': df['volume'].rolling(20).mean().to_numpy(),
+            'rsi_14': self.calculate_rsi(close, 14).to_numpy(),
+            'rsi_21': self.calculate_rsi(close, 21).to_numpy(),
+            'ema_12': close.ewm(span=12).mean().to_numpy(),
+            'ema_26': close.ewm(span=26).mean().to_numpy(),
+            'ema_20': close.ewm(span=20).mean().to_numpy(),
+            'ema_50': close.ewm(span=50).mean().to_numpy(),
+            'macd_line': macd_line.to_numpy(),
+            'macd_signal': signal_line.to_numpy(),
+            'high_20': df['high'].rolling(20).max().to_numpy(),
+            'low_20': df['low'].rolling(20).min().to_numpy(),
+            'trend_4h': bool(trend_4h),
+        }
     
-    def check_support_resistance(self, df: pd.DataFrame, current_price: float) -> bool:
-        """WIN RATE IMPROVEMENT #2: Relaxed support/resistance filtering."""
-        if len(df) < 20:
-            return True  # Allow if not enough data
-        
-        # Find recent highs and lows
-        recent_highs = df['high'].rolling(20).max()
-        recent_lows = df['low'].rolling(20).min()
-        
-        # Check if price is near key levels (within 3% - more lenient)
-        resistance_near = abs(current_price - recent_highs.iloc[-1]) / current_price < 0.03
-        support_near = abs(current_price - recent_lows.iloc[-1]) / current_price < 0.03
-        
-        # Allow if near any key level OR if price is in middle range
-        price_range = (recent_highs.iloc[-1] - recent_lows.iloc[-1]) / recent_lows.iloc[-1]
-        in_middle_range = 0.3 < (current_price - recent_lows.iloc[-1]) / (recent_highs.iloc[-1] - recent_lows.iloc[-1]) < 0.7
+    def check_multi_timeframe_trend(self, ind: Dict[str, np.ndarray]) -> np.ndarray:
+        """WIN RATE IMPROVEMENT #1: Relaxed multi-timeframe confirmation, per candle."""
+        # 1H trend (more lenient); at least one timeframe should be bullish
+        passed = (ind['ema_20'] > ind['ema_50']) | ind['trend_4h']
+        passed[:49] = True  # Allow if not enough data
+        return passed
+    
+    def check_support_resistance(self, ind: Dict[str, np.ndarray]) -> np.ndarray:
+        """WIN RATE IMPROVEMENT #2: Relaxed support/resistance filtering, per candle."""
+        close = ind['close']
+        recent_highs = ind['high_20']
+        recent_lows = ind['low_20']
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Check if price is near key levels (within 3% - more lenient)
+            resistance_near = np.abs(close - recent_highs) / close < 0.03
+            support_near = np.abs(close - recent_lows) / close < 0.03
+            
+            # Allow if near any key level OR if price is in middle range
+            range_position = (close - recent_lows) / (recent_highs - recent_lows)
+            in_middle_range = (range_position > 0.3) & (range_position < 0.7)
         
-        return resistance_near or support_near or in_middle_range
+        passed = resistance_near | support_near | in_middle_range
+        passed[:19] = True  # Allow if not enough data
+        return passed
     
-    def check_momentum_confirmation(self, df: pd.DataFrame) -> bool:
-        """WIN RATE IMPROVEMENT #3: Relaxed momentum confirmation."""
-        if len(df) < 50:
-            return True  # Allow if not enough data
+    def check_momentum_confirmation(self, ind: Dict[str, np.ndarray]) -> np.ndarray:
+        """WIN RATE IMPROVEMENT #3: Relaxed momentum confirmation, per candle."""
+        close = ind['close']
         
         # RSI momentum (more lenient)
-        rsi = self.calculate_rsi(df['close'], 14)
-        rsi_momentum = rsi.iloc[-1] > 45  # Less strict than 50
+        rsi_momentum = ind['rsi_14'] > 45  # Less strict than 50
         
         # MACD momentum (more lenient)
-        macd_line, signal_line, _ = self.calculate_macd(df['close'])
-        macd_momentum = macd_line.iloc[-1] > signal_line.iloc[-1] * 0.95  # Allow small negative
+        macd_momentum = ind['macd_line'] > ind['macd_signal'] * 0.95  # Allow small negative
         
-        # Price momentum (more lenient)
-        if len(df) >= 5:
-            price_change = (df['close'].iloc[-1] - df['close'].iloc[-5]) / df['close'].iloc[-5]
-            price_momentum = price_change > -0.005  # Allow small negative momentum
-        else:
-            price_momentum = True
+        # Price momentum (more lenient), over the last 5 candles
+        price_change = np.full(len(close), np.nan)
+        price_change[4:] = (close[4:] - close[:-4]) / close[:-4]
+        price_momentum = price_change > -0.005  # Allow small negative momentum
         
         # At least 2 out of 3 should be positive
-        positive_signals = sum([rsi_momentum, macd_momentum, price_momentum])
-        return positive_signals >= 2
+        positive_signals = rsi_momentum.astype(int) + macd_momentum + price_momentum
+        passed = positive_signals >= 2
+        passed[:49] = True  # Allow if not enough data
+        return passed
     
     def generate_enhanced_signals(self, df: pd.DataFrame, symbol: str) -> List[Dict]:
         """Generate signals with balanced win rate improvements."""
@@ -200,100 +216,93 @@ class BalancedWinRateBacktest:
         print(f"   📊 1H Data Points: {len(df)}")
         print(f"   📊 4H Data Points: {len(df_4h)}")
         
-        # Track filter effectiveness
-        total_candidates = 0
+        # Every filter and score term is evaluated for all candles at once
+        ind = self.compute_indicators(df, df_4h)
+        close = ind['close']
+        rsi_14 = ind['rsi_14']
+        rsi_21 = ind['rsi_21']
+        ema_12 = ind['ema_12']
+        ema_26 = ind['ema_26']
+        
+        # Candidates start once 100 candles of history are available
+        passed = np.arange(len(df)) >= 100
+        total_candidates = int(passed.sum())
         multi_timeframe_passed = 0
         support_resistance_passed = 0
         momentum_passed = 0
-        final_signals = 0
         
-        for i in range(100, len(df)):
-            current = df.iloc[i]
-            total_candidates += 1
-            
-            # WIN RATE IMPROVEMENT #1: Multi-timeframe confirmation (relaxed)
-            if self.multi_timeframe_required:
-                if not self.check_multi_timeframe_trend(df.iloc[:i+1], df_4h):
-                    continue
-                multi_timeframe_passed += 1
-            
-            # WIN RATE IMPROVEMENT #2: Support/Resistance filtering (relaxed)
-            if self.support_resistance_required:
-                if not self.check_support_resistance(df.iloc[:i+1], current['close']):
-                    continue
-                support_resistance_passed += 1
-            
-            # WIN RATE IMPROVEMENT #3: Momentum confirmation (relaxed)
-            if self.momentum_confirmation_required:
-                if not self.check_momentum_confirmation(df.iloc[:i+1]):
-                    continue
-                momentum_passed += 1
-            
-            # Original signal generation with enhanced scoring
-            rsi_14 = self.calculate_rsi(df['close'], 14)
-            rsi_21 = self.calculate_rsi(df['close'], 21)
-            ema_12 = df['close'].ewm(span=12).mean()
-            ema_26 = df['close'].ewm(span=26).mean()
-            
-            # Enhanced signal scoring
-            score = 0.4  # Lower base score for more signals
-            
-            # RSI signals (enhanced but more lenient)
-            if rsi_14.iloc[i] < 35 and rsi_21.iloc[i] < 40:  # More lenient oversold
-                score += 0.15  # Oversold bonus
-            elif rsi_14.iloc[i] > 65 and rsi_21.iloc[i] > 60:  # More lenient overbought
-                score -= 0.15  # Overbought penalty
-            
-            # EMA trend signals (enhanced)
-            if ema_12.iloc[i] > ema_26.iloc[i]:
-                score += 0.15  # Uptrend bonus
-            elif ema_12.iloc[i] < ema_26.iloc[i]:
-                score -= 0.15  # Downtrend penalty
-            
-            # Volume confirmation (enhanced but more lenient)
-            avg_volume = df['volume'].rolling(20).mean()
-            if df['volume'].iloc[i] > avg_volume.iloc[i] * 1.2:  # Lower volume requirement
-                score += 0.1  # Volume bonus
+        # WIN RATE IMPROVEMENT #1: Multi-timeframe confirmation (relaxed)
+        if self.multi_timeframe_required:
+            passed &= self.check_multi_timeframe_trend(ind)
+            multi_timeframe_passed = int(passed.sum())
+        
+        # WIN RATE IMPROVEMENT #2: Support/Resistance filtering (relaxed)
+        if self.support_resistance_required:
+            passed &= self.check_support_resistance(ind)
+            support_resistance_passed = int(passed.sum())
+        
+        # WIN RATE IMPROVEMENT #3: Momentum confirmation (relaxed)
+        if self.momentum_confirmation_required:
+            passed &= self.check_momentum_confirmation(ind)
+            momentum_passed = int(passed.sum())
+        
+        # Enhanced signal scoring; terms are added in the same order as before
+        # so scores on the min_score boundary round the same way
+        score = np.full(len(df), 0.4)  # Lower base score for more signals
+        
+        # RSI signals (enhanced but more lenient): oversold bonus, overbought penalty
+        oversold = (rsi_14 < 35) & (rsi_21 < 40)
+        overbought = (rsi_14 > 65) & (rsi_21 > 60)
+        score += np.where(oversold, 0.15, np.where(overbought, -0.15, 0.0))
+        
+        # EMA trend signals (enhanced): uptrend bonus, downtrend penalty
+        score += np.where(ema_12 > ema_26, 0.15, np.where(ema_12 < ema_26, -0.15, 0.0))
+        
+        # Volume confirmation (enhanced but more lenient)
+        score += np.where(ind['volume'] > ind['volume_ma_20'] * 1.2, 0.1, 0.0)
+        
+        # Additional momentum bonus (0.5% over 5 candles)
+        price_change = np.full(len(df), np.nan)
+        price_change[5:] = (close[5:] - close[:-5]) / close[:-5]
+        score += np.where(price_change > 0.005, 0.1, 0.0)
+        
+        # Only generate signal if score is high enough
+        selected = np.flatnonzero(passed & (score >= self.min_score))
+        
+        for signal_id, i in enumerate(selected, start=1):
+            entry_price = close[i]
+            signal_score = float(score[i])
+            direction = 'LONG' if signal_score > 0.5 else 'SHORT'
             
-            # Additional momentum bonus
-            if len(df) >= 5:
-                price_change = (df['close'].iloc[i] - df['close'].iloc[i-5]) / df['close'].iloc[i-5]
-                if price_change > 0.005:  # 0.5% positive momentum
-                    score += 0.1
+            # Calculate TP/SL levels (more conservative)
+            if direction == 'LONG':
+                take_profit = entry_price * 1.015  # 1.5% TP
+                stop_loss = entry_price * 0.985   # 1.5% SL
+            else:
+                take_profit = entry_price * 0.985  # 1.5% TP
+                stop_loss = entry_price * 1.015   # 1.5% SL
             
-            # Only generate signal if score is high enough
-            if score >= self.min_score:
-                direction = 'LONG' if score > 0.5 else 'SHORT'
-                
-                # Calculate TP/SL levels (more conservative)
-                if direction == 'LONG':
-                    take_profit = current['close'] * 1.015  # 1.5% TP
-                    stop_loss = current['close'] * 0.985   # 1.5% SL
-                else:
-                    take_profit = current['close'] * 0.985  # 1.5% TP
-                    stop_loss = current['close'] * 1.015   # 1.5% SL
-                
-                signals.append({
-                    'id': len(signals) + 1,
-                    'symbol': symbol,
-                    'signal_type': 'BALANCED_WIN_RATE',
-                    'direction': direction,
-                    'entry_price': current['close'],
-                    'take_profit_1': take_profit,
-                    'stop_loss': stop_loss,
-                    'score': score,
-                    'is_active': True,
-                    'created_at': current.name,
-                    'realized_pnl': 0.0,
-                    'win_rate_improvements': {
-                        'multi_timeframe': True,
-                        'support_resistance': True,
-                        'momentum_confirmation': True,
-                        'sentiment_filter': False,
-                        'entry_timing': False
-                    }
-                })
-                final_signals += 1
+            signals.append({
+                'id': signal_id,
+                'symbol': symbol,
+                'signal_type': 'BALANCED_WIN_RATE',
+                'direction': direction,
+                'entry_price': entry_price,
+                'take_profit_1': take_profit,
+                'stop_loss': stop_loss,
+                'score': signal_score,
+                'is_active': True,
+                'created_at': df.index[i],
+                'realized_pnl': 0.0,
+                'win_rate_improvements': {
+                    'multi_timeframe': True,
+                    'support_resistance': True,
+                    'momentum_confirmation': True,
+                    'sentiment_filter': False,
+                    'entry_timing': False
+                }
+            })
+        final_signals = len(signals)
         
         # Display filter effectiveness
         print(f"   📊 Filter Effectiveness:")
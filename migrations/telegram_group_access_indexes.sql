@@ -0,0 +1,12 @@
+-- Indexes matching the telegram_group_access queries in apps/api/services/telegram_group_manager.py
+-- (user_id, group_name) WHERE is_active is covered by uq_telegram_group_access_active_user_group
+-- from telegram_group_access_unique_active.sql
+
+-- Active members per group (group statistics) and active rows overall (membership sync)
+CREATE INDEX IF NOT EXISTS idx_telegram_group_access_group_active
+    ON telegram_group_access(group_name)
+    WHERE is_active;
+
+-- A user's access history, newest first
+CREATE INDEX IF NOT EXISTS idx_telegram_group_access_user_created_at
+    ON telegram_group_access(user_id, created_at DESC);
@@ -0,0 +1,19 @@
+-- Enforce at most one active Telegram group access per user and group
+-- Lets grant_telegram_access use INSERT ... ON CONFLICT DO NOTHING instead of a pre-check SELECT
+
+-- Deactivate duplicate active rows, keeping the most recent grant
+UPDATE telegram_group_access t
+SET is_active = FALSE,
+    access_revoked_at = COALESCE(t.access_revoked_at, NOW())
+WHERE t.is_active
+  AND EXISTS (
+      SELECT 1 FROM telegram_group_access newer
+      WHERE newer.user_id = t.user_id
+        AND newer.group_name = t.group_name
+        AND newer.is_active
+        AND newer.id > t.id
+  );
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_telegram_group_access_active_user_group
+    ON telegram_group_access(user_id, group_name)
+    WHERE is_active;
@@ -0,0 +1,6 @@
+-- Index for the expired-trials cleanup task (BillingManager.cleanup_expired_trials)
+-- Only users currently on a trial are indexed, so the hourly "nothing expired" check stays cheap
+
+CREATE INDEX IF NOT EXISTS idx_users_trial_start_date_active_trial
+    ON users(trial_start_date)
+    WHERE subscription_status = 'trial';
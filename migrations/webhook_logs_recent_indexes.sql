@@ -0,0 +1,6 @@
+-- Indexes for the webhook monitoring queries (most recent first, optionally filtered)
+-- Used by get_recent_webhook_logs and get_failed_webhooks in apps/api/services/webhook_logger.py
+
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_created_at_desc ON webhook_logs(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_payment_method_created_at ON webhook_logs(payment_method, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_status_created_at ON webhook_logs(processing_status, created_at DESC);